@@ -0,0 +1,153 @@
+import json
+import statistics
+import time
+from typing import Callable, Dict, NamedTuple, Optional
+
+import click
+
+DEFAULT_MIN_TIME = 0.2
+"""Seconds each benchmark runs for, at least"""
+DEFAULT_THRESHOLD = 1.2
+"""Slowdown ratio against the baseline that counts as a regression"""
+
+
+class Result(NamedTuple):
+    median: float
+    """Seconds per call, or a value in unit"""
+    best: float
+    runs: int
+    unit: str = "s"
+    higher_is_better: bool = False
+    tolerance: float = 0.0
+    """Absolute worsening ignored when comparing, for values that can be zero"""
+
+    def to_json(self) -> dict:
+        return self._asdict()
+
+
+def measure(
+    func: Callable[[], object],
+    min_time=DEFAULT_MIN_TIME,
+    setup: Optional[Callable[[], object]] = None,
+) -> Result:
+    """Call func repeatedly for at least min_time seconds. setup is called
+    before every call and is not timed"""
+    samples = []
+    deadline = time.perf_counter() + min_time
+
+    # Always take a few samples so the median means something
+    while len(samples) < 5 or time.perf_counter() < deadline:
+        if setup is not None:
+            setup()
+
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+
+    return Result(
+        median=statistics.median(samples), best=min(samples), runs=len(samples)
+    )
+
+
+def format_time(seconds: float) -> str:
+    if seconds < 1e-3:
+        return "%.1f us" % (seconds * 1e6)
+    if seconds < 1:
+        return "%.2f ms" % (seconds * 1e3)
+
+    return "%.2f s" % seconds
+
+
+def format_value(value: float, unit: str) -> str:
+    if unit == "s":
+        return format_time(value)
+
+    return "%.1f %s" % (value, unit)
+
+
+def report(results: Dict[str, Result], baseline: Optional[Dict[str, dict]] = None):
+    width = max(map(len, results), default=0)
+    for name, result in results.items():
+        line = "%s  %10s  (best %s, %d runs)" % (
+            name.ljust(width),
+            format_value(result.median, result.unit),
+            format_value(result.best, result.unit),
+            result.runs,
+        )
+        if baseline and name in baseline and baseline[name]["median"]:
+            line += "  x%.2f" % (result.median / baseline[name]["median"])
+
+        click.echo(line)
+
+
+def save_results(path: str, results: Dict[str, Result]):
+    with open(path, "w") as fp:
+        json.dump({name: r.to_json() for name, r in results.items()}, fp, indent=2)
+
+
+def load_results(path: str) -> Dict[str, dict]:
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def find_regressions(
+    results: Dict[str, Result], baseline: Dict[str, dict], threshold=DEFAULT_THRESHOLD
+) -> Dict[str, float]:
+    """Return the worsening ratio of every benchmark worse than threshold"""
+    out = {}
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        value = result.median
+        reference = baseline[name]["median"]
+        if result.higher_is_better:
+            value, reference = reference, value
+
+        if value > reference * threshold + result.tolerance:
+            out[name] = value / reference if reference else float("inf")
+
+    return out
+
+
+def finish(
+    results: Dict[str, Result],
+    save: Optional[str],
+    compare: Optional[str],
+    threshold: float,
+):
+    """Print, save and compare results. Exit with status 1 on regressions"""
+    baseline = load_results(compare) if compare else None
+    report(results, baseline)
+
+    if save:
+        save_results(save, results)
+        click.echo("Saved results to %s" % save)
+
+    if baseline:
+        regressions = find_regressions(results, baseline, threshold)
+        for name, ratio in regressions.items():
+            click.echo("REGRESSION %s is %.2fx worse than baseline" % (name, ratio))
+
+        if regressions:
+            raise SystemExit(1)
+
+
+def common_options(f):
+    f = click.option(
+        "--threshold",
+        default=DEFAULT_THRESHOLD,
+        show_default=True,
+        help="Slowdown ratio counted as regression when comparing",
+    )(f)
+    f = click.option(
+        "--compare", type=click.Path(exists=True), help="Baseline JSON to compare with"
+    )(f)
+    f = click.option("--save", type=click.Path(), help="Save results as JSON")(f)
+    f = click.option(
+        "--min-time",
+        default=DEFAULT_MIN_TIME,
+        show_default=True,
+        help="Seconds to run each benchmark for",
+    )(f)
+    return f
@@ -0,0 +1,304 @@
+"""Benchmark the capture -> crop -> encode -> RPC pipeline on synthetic frames.
+
+Runs without the game or a display:
+
+    python -m benchmarks.pipeline --save baseline.json
+    python -m benchmarks.pipeline --compare baseline.json
+"""
+import base64
+import itertools
+import json
+import logging
+import os
+import types
+from typing import Dict, List
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import click
+import numpy as np
+from PySide2.QtCore import QObject, QRect, QUrl
+from PySide2.QtWidgets import QApplication, QGraphicsRectItem, QGraphicsScene
+
+from runekit.browser.api import Alt1Api, RuneKitRequestProcess
+from runekit.browser.utils import (
+    RgbaEncoder,
+    decode_image,
+    ensure_image_rgba,
+    image_to_stream,
+)
+from runekit.game.instance import GameInstance
+from runekit.image import color_stats, is_color_percent_gte
+from runekit.image.np_utils import np_crop
+from .harness import Result, common_options, finish, measure
+
+FRAME_SIZES = {
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "1440p": (2560, 1440),
+    "4k": (3840, 2160),
+}
+REGION_SIZE = (200, 100)
+OVERLAY_CALLS = (10, 100)
+STATS_COLORS = [(255, 255, 255), (255, 0, 0), (0, 255, 0), (0, 0, 255)]
+
+
+class SyntheticGameInstance(GameInstance):
+    """Game instance that serves deterministic frames, alternating between two
+    so every grab produces a new frame version"""
+
+    refresh_rate = 100
+
+    def __init__(self, width: int, height: int, **kwargs):
+        super().__init__(**kwargs)
+        self.width = width
+        self.height = height
+
+        rng = np.random.default_rng(0)
+        self.frames = []
+        for _ in range(2):
+            frame = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+            frame[:, :, 3] = 0xFF
+            self.frames.append(frame)
+
+        self.scene = QGraphicsScene()
+        self.overlay = QGraphicsRectItem(0, 0, width, height)
+        self.scene.addItem(self.overlay)
+
+    def get_position(self) -> QRect:
+        return QRect(0, 0, self.width, self.height)
+
+    def get_scaling(self) -> float:
+        return 1.0
+
+    def is_focused(self) -> bool:
+        return True
+
+    def get_world(self):
+        return None
+
+    def grab_game(self) -> np.ndarray:
+        self.frame_version += 1
+        return self.frames[self.frame_version % 2]
+
+    def grab_desktop(self, x: int, y: int, w: int, h: int) -> np.ndarray:
+        return np_crop(self.frames[0], x, y, w, h)
+
+    def get_overlay_area(self):
+        return self.overlay
+
+
+class BenchmarkApp:
+    """The parts of App used by Alt1Api"""
+
+    manifest = {"appName": "benchmark"}
+
+    def __init__(self, game_instance: GameInstance):
+        self.game_instance = game_instance
+
+    def has_permission(self, permission: str) -> bool:
+        return True
+
+
+class FakeRequest(QObject):
+    failed = False
+
+    def __init__(self, msg: dict, **kwargs):
+        super().__init__(**kwargs)
+        self.url = QUrl()
+        self.url.setScheme("rk")
+        self.url.setPath(json.dumps(msg))
+
+    def requestUrl(self) -> QUrl:
+        return self.url
+
+    def fail(self, _):
+        self.failed = True
+
+
+def rpc_runner(api: Alt1Api):
+    handler = types.SimpleNamespace(api=api, logger=logging.getLogger("benchmark"))
+
+    def run(msg: dict):
+        request = FakeRequest(msg)
+        RuneKitRequestProcess(handler, request).run()
+        if request.failed:
+            raise RuntimeError("RPC failed: %r" % msg)
+
+    return run
+
+
+def region_rects(count: int, width: int, height: int, shift: int) -> List[dict]:
+    """Return count regions spread over the frame. shift moves them to defeat caches"""
+    w, h = REGION_SIZE
+    columns = max(1, width // w)
+    return [
+        {
+            "x": (i % columns) * w + shift % 8,
+            "y": ((i // columns) * h) % (height - h),
+            "width": w,
+            "height": h,
+        }
+        for i in range(count)
+    ]
+
+
+def bench_frame_size(
+    name: str, width: int, height: int, region_counts: List[int], min_time: float
+) -> Dict[str, Result]:
+    instance = SyntheticGameInstance(width, height)
+    api = Alt1Api(BenchmarkApp(instance))
+    rpc = rpc_runner(api)
+    frame = instance.frames[0]
+    counter = itertools.count()
+    out = {}
+
+    try:
+        out[f"np_crop.full[{name}]"] = measure(
+            lambda: np_crop(frame, 0, 0, width, height), min_time
+        )
+        out[f"np_crop.padded[{name}]"] = measure(
+            lambda: np_crop(frame, -10, -10, width, height), min_time
+        )
+        out[f"image_to_stream.rgba[{name}]"] = measure(
+            lambda: image_to_stream(frame, mode="rgba", ignore_limit=True), min_time
+        )
+        encoder = RgbaEncoder()
+        out[f"RgbaEncoder.encode[{name}]"] = measure(
+            lambda: encoder.encode(frame), min_time
+        )
+        out[f"RgbaEncoder.encode.padded[{name}]"] = measure(
+            lambda: encoder.encode(frame, -10, -10, width, height), min_time
+        )
+        out[f"is_color_percent_gte[{name}]"] = measure(
+            lambda: is_color_percent_gte(frame, [0, 0, 0], 0.5), min_time
+        )
+        out[f"color_stats[{name}]"] = measure(
+            lambda: color_stats(frame, STATS_COLORS, 8, projections=True), min_time
+        )
+        out[f"rpc.getRegionRaw[{name}]"] = measure(
+            lambda: rpc(
+                {
+                    "func": "getRegionRaw",
+                    "x": next(counter) % 8,
+                    "y": 0,
+                    "w": width - 8,
+                    "h": height,
+                }
+            ),
+            min_time,
+        )
+
+        out[f"rpc.getRegionChanged[{name}]"] = measure(
+            lambda: rpc(
+                {"func": "getRegionChanged", "x": 0, "y": 0, "w": 400, "h": 300}
+            ),
+            min_time,
+        )
+
+        for count in region_counts:
+            out[f"rpc.getRegionMulti[{name},{count}]"] = measure(
+                lambda: rpc(
+                    {
+                        "func": "getRegionMulti",
+                        "rects": region_rects(count, width, height, next(counter)),
+                    }
+                ),
+                min_time,
+            )
+            out[f"rpc.captureMulti[{name},{count}]"] = measure(
+                lambda: rpc(
+                    {
+                        "func": "captureMulti",
+                        "areas": {
+                            str(i): rect
+                            for i, rect in enumerate(
+                                region_rects(count, width, height, next(counter))
+                            )
+                        },
+                    }
+                ),
+                min_time,
+            )
+    finally:
+        instance.capture.stop()
+
+    return out
+
+
+def bench_common(min_time: float) -> Dict[str, Result]:
+    w, h = REGION_SIZE
+    rng = np.random.default_rng(1)
+    region = rng.integers(0, 256, (h, w, 4), dtype=np.uint8)
+    encoded = base64.b64encode(ensure_image_rgba(region).tobytes()).decode("ascii")
+
+    out = {
+        "ensure_image_rgba[region]": measure(
+            lambda: ensure_image_rgba(region), min_time
+        ),
+        "decode_image[region]": measure(lambda: decode_image(encoded, w), min_time),
+    }
+
+    width, height = FRAME_SIZES["1080p"]
+    instance = SyntheticGameInstance(width, height)
+    api = Alt1Api(BenchmarkApp(instance))
+    overlay = api._overlay
+    call_ids = itertools.count(1)
+
+    try:
+        for calls in OVERLAY_CALLS:
+
+            def setup():
+                overlay.overlay_clear_group(overlay.current_group)
+                for i in range(calls):
+                    overlay.enqueue(
+                        next(call_ids),
+                        "overlay_rect",
+                        0xFFFF0000,
+                        i,
+                        i,
+                        50,
+                        50,
+                        20000,
+                        10,
+                    )
+
+            out[f"OverlayApi.process_queue[{calls}]"] = measure(
+                overlay.process_queue, min_time, setup=setup
+            )
+    finally:
+        instance.capture.stop()
+
+    return out
+
+
+@click.command()
+@click.option(
+    "--sizes",
+    default="720p,1080p,1440p,4k",
+    show_default=True,
+    help="Comma separated frame sizes: " + ", ".join(FRAME_SIZES),
+)
+@click.option(
+    "--regions",
+    default="1,4,16",
+    show_default=True,
+    help="Comma separated region counts for multi region calls",
+)
+@common_options
+def main(sizes, regions, min_time, save, compare, threshold):
+    logging.basicConfig(level=logging.WARNING)
+    app = QApplication(["runekit-benchmark"])
+
+    region_counts = [int(count) for count in regions.split(",")]
+    results = bench_common(min_time)
+    for name in sizes.split(","):
+        width, height = FRAME_SIZES[name]
+        results.update(bench_frame_size(name, width, height, region_counts, min_time))
+
+    finish(results, save, compare, threshold)
+    app.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""End to end X11 capture benchmark on Xvfb.
+
+Starts a private Xvfb server with Composite and DAMAGE, opens a window that
+looks like the game to X11GameManager and keeps animating it, then grabs it
+in a loop:
+
+    python -m benchmarks.x11_capture --save x11.json
+    python -m benchmarks.x11_capture --compare x11.json
+
+Requires Xvfb in PATH.
+"""
+import logging
+import multiprocessing
+import os
+import statistics
+import struct
+import subprocess
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+import click
+import psutil
+
+MODE_STILL = 0
+MODE_BOX = 1
+MODE_FULL = 2
+SCENARIOS = {
+    "still": MODE_STILL,
+    "damaged": MODE_BOX,
+    "full": MODE_FULL,
+}
+"""Nothing changes, a small box moves, or the whole window is repainted every frame"""
+DRAW_FPS = 60
+BOX_SIZE = 64
+SHM_ATTACH_TOLERANCE = 2
+"""Extra shm attaches per scenario not counted as a regression"""
+RSS_GROWTH_TOLERANCE = 16
+"""Extra RSS growth per scenario not counted as a regression, in MiB"""
+
+
+@contextmanager
+def xvfb(width: int, height: int):
+    read_fd, write_fd = os.pipe()
+    proc = subprocess.Popen(
+        [
+            "Xvfb",
+            "-displayfd",
+            str(write_fd),
+            "-screen",
+            "0",
+            "%dx%dx24" % (width, height),
+            "+extension",
+            "Composite",
+            "+extension",
+            "DAMAGE",
+            "-nolisten",
+            "tcp",
+        ],
+        pass_fds=[write_fd],
+    )
+    os.close(write_fd)
+
+    try:
+        display = b""
+        while not display.endswith(b"\n"):
+            chunk = os.read(read_fd, 16)
+            if not chunk:
+                raise RuntimeError("Xvfb exited before reporting its display")
+            display += chunk
+
+        yield ":" + display.decode("ascii").strip()
+    finally:
+        os.close(read_fd)
+        proc.terminate()
+        proc.wait()
+
+
+def draw_window(display: str, width: int, height: int, mode, ready):
+    """Open a window with the game WM_CLASS and animate it. Runs in a child process"""
+    import xcffib
+    import xcffib.xproto
+    from runekit.game.x11.manager import WM_APP_NAME
+
+    xproto = xcffib.xproto
+    conn = xcffib.Connection(display)
+    screen = conn.get_setup().roots[conn.pref_screen]
+
+    wid = conn.generate_id()
+    conn.core.CreateWindow(
+        screen.root_depth,
+        wid,
+        screen.root,
+        0,
+        0,
+        width,
+        height,
+        0,
+        xproto.WindowClass.InputOutput,
+        screen.root_visual,
+        xproto.CW.BackPixel,
+        [screen.black_pixel],
+    )
+    wm_class = b"benchmark\0" + WM_APP_NAME.encode("ascii") + b"\0"
+    conn.core.ChangeProperty(
+        xproto.PropMode.Replace,
+        wid,
+        xproto.Atom.WM_CLASS,
+        xproto.Atom.STRING,
+        8,
+        len(wm_class),
+        wm_class,
+    )
+    pid_name = b"_NET_WM_PID"
+    pid_atom = conn.core.InternAtom(False, len(pid_name), pid_name).reply().atom
+    conn.core.ChangeProperty(
+        xproto.PropMode.Replace,
+        wid,
+        pid_atom,
+        xproto.Atom.CARDINAL,
+        32,
+        1,
+        struct.pack("=I", os.getpid()),
+    )
+    gc = conn.generate_id()
+    conn.core.CreateGC(gc, wid, xproto.GC.Foreground, [0])
+    conn.core.MapWindow(wid)
+    conn.flush()
+    ready.set()
+
+    frame = 0
+    while True:
+        frame += 1
+        conn.core.ChangeGC(gc, xproto.GC.Foreground, [(frame * 0x010305) & 0xFFFFFF])
+
+        if mode.value == MODE_BOX:
+            x = (frame * 7) % (width - BOX_SIZE)
+            y = (frame * 3) % (height - BOX_SIZE)
+            rect = xproto.RECTANGLE.synthetic(x, y, BOX_SIZE, BOX_SIZE)
+            conn.core.PolyFillRectangle(wid, gc, 1, [rect])
+        elif mode.value == MODE_FULL:
+            rect = xproto.RECTANGLE.synthetic(0, 0, width, height)
+            conn.core.PolyFillRectangle(wid, gc, 1, [rect])
+
+        conn.flush()
+        time.sleep(1 / DRAW_FPS)
+
+
+def bench_scenario(instance, frames: int, hold: int) -> dict:
+    from runekit.metrics import metrics
+
+    held = []
+    # Let the window paint at least once so damage events are flowing
+    for _ in range(10):
+        instance.grab_game()
+
+    metrics.reset()
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+    samples = []
+    start = time.perf_counter()
+
+    for _ in range(frames):
+        grab_start = time.perf_counter()
+        image = instance.grab_game()
+        samples.append(time.perf_counter() - grab_start)
+
+        # Emulate apps holding on to recent frames
+        if hold:
+            held.append(image)
+            del held[:-hold]
+
+    elapsed = time.perf_counter() - start
+    counters = metrics.snapshot()["counters"]
+    samples.sort()
+
+    return {
+        "fps": frames / elapsed,
+        "median": statistics.median(samples),
+        "p95": samples[int(len(samples) * 0.95)],
+        "best": samples[0],
+        "shm_attach": counters.get("capture.shm_attach", 0),
+        "rss_growth": process.memory_info().rss - rss_before,
+    }
+
+
+@click.command()
+@click.option("--width", default=1280, show_default=True)
+@click.option("--height", default=720, show_default=True)
+@click.option("--frames", default=300, show_default=True, help="Grabs per scenario")
+@click.option(
+    "--hold",
+    default=0,
+    show_default=True,
+    help="Number of recent frames kept alive, like apps holding bound regions",
+)
+@click.option("--save", type=click.Path(), help="Save results as JSON")
+@click.option(
+    "--compare", type=click.Path(exists=True), help="Baseline JSON to compare with"
+)
+@click.option("--threshold", default=1.2, show_default=True)
+def main(width, height, frames, hold, save, compare, threshold):
+    from .harness import Result, finish
+
+    logging.basicConfig(level=logging.WARNING)
+    spawn = multiprocessing.get_context("spawn")
+
+    with xvfb(width + 100, height + 100) as display:
+        os.environ["DISPLAY"] = display
+        os.environ["QT_QPA_PLATFORM"] = "xcb"
+
+        mode = spawn.Value("i", MODE_STILL)
+        ready = spawn.Event()
+        drawer = spawn.Process(
+            target=draw_window, args=(display, width, height, mode, ready), daemon=True
+        )
+        drawer.start()
+        ready.wait(10)
+
+        from PySide2.QtWidgets import QApplication
+        from runekit.game.x11.manager import X11GameManager
+
+        app = QApplication(["runekit-benchmark"])
+        manager = X11GameManager()
+        results: Dict[str, Result] = {}
+
+        try:
+            instances = manager.get_instances()
+            if not instances:
+                raise click.ClickException("Benchmark window was not detected")
+
+            instance = instances[0]
+            instance.on_capture_thread_start()
+
+            for name, scenario_mode in SCENARIOS.items():
+                mode.value = scenario_mode
+                time.sleep(0.2)
+                stats = bench_scenario(instance, frames, hold)
+                results["grab_game[%s]" % name] = Result(
+                    median=stats["median"], best=stats["best"], runs=frames
+                )
+                results["fps[%s]" % name] = Result(
+                    median=stats["fps"],
+                    best=stats["fps"],
+                    runs=frames,
+                    unit="fps",
+                    higher_is_better=True,
+                )
+                results["shm_attach[%s]" % name] = Result(
+                    median=stats["shm_attach"],
+                    best=stats["shm_attach"],
+                    runs=frames,
+                    unit="attaches",
+                    tolerance=SHM_ATTACH_TOLERANCE,
+                )
+                rss_growth = stats["rss_growth"] / 2**20
+                results["rss_growth[%s]" % name] = Result(
+                    median=rss_growth,
+                    best=rss_growth,
+                    runs=frames,
+                    unit="MiB",
+                    tolerance=RSS_GROWTH_TOLERANCE,
+                )
+
+            instance.on_capture_thread_stop()
+        finally:
+            drawer.terminate()
+            manager.stop()
+            app.quit()
+
+    finish(results, save, compare, threshold)
+
+
+if __name__ == "__main__":
+    main()
@@ -51,7 +51,7 @@
 
     function syncRpc(msg, json) {
         let xhr = new XMLHttpRequest();
-        xhr.open('GET', 'rk:' + JSON.stringify(msg), false); // sync xhr
+        xhr.open('GET', 'rk:' + encodeURIComponent(JSON.stringify(msg)), false); // sync xhr
         xhr.overrideMimeType('text/plain; charset=x-user-defined');
         xhr.setRequestHeader('token', RPC_TOKEN);
         xhr.send(null);
@@ -65,7 +65,7 @@
     function asyncRpc(msg, responseType='') {
         return new Promise((resolve, reject) => {
             let xhr = new XMLHttpRequest();
-            xhr.open('GET', 'rk:' + JSON.stringify(msg));
+            xhr.open('GET', 'rk:' + encodeURIComponent(JSON.stringify(msg)));
             xhr.setRequestHeader('token', RPC_TOKEN);
             xhr.responseType = responseType;
             xhr.addEventListener('load', (e) => {
@@ -81,6 +81,87 @@
         })
     }
 
+    // Binary pixel RPC. Must match runekit/browser/utils.py
+    const BINARY_FUNCS = {
+        getRegionRaw: 1,
+        bindGetRegionRaw: 2,
+    };
+    const BINARY_REQUEST_SIZE = 24;
+    const BINARY_RESPONSE_SIZE = 16;
+    const BINARY_MAGIC = 0x31424b52; // RKB1
+    const BINARY_ERRORS = {
+        0: 'Region is not bound',
+        2: 'Region is over the transfer limit',
+    };
+
+    function encodeBinaryRequest(func, id, x, y, w, h) {
+        let view = new DataView(new ArrayBuffer(BINARY_REQUEST_SIZE));
+        view.setUint8(0, BINARY_FUNCS[func]);
+        view.setUint32(4, id, true);
+        view.setInt32(8, x, true);
+        view.setInt32(12, y, true);
+        view.setInt32(16, w, true);
+        view.setInt32(20, h, true);
+
+        let str = String.fromCharCode.apply(null, new Uint8Array(view.buffer));
+        return btoa(str).replace(/\+/g, '-').replace(/\//g, '_').replace(/=+$/, '');
+    }
+
+    function binaryRpc(func, id, x, y, w, h) {
+        return new Promise((resolve, reject) => {
+            let xhr = new XMLHttpRequest();
+            xhr.open('GET', 'rk:bin/' + encodeBinaryRequest(func, id, x, y, w, h));
+            xhr.setRequestHeader('token', RPC_TOKEN);
+            xhr.responseType = 'arraybuffer';
+            xhr.addEventListener('load', (e) => {
+                let header = new DataView(xhr.response, 0, BINARY_RESPONSE_SIZE);
+                if (header.getUint32(0, true) !== BINARY_MAGIC) {
+                    e.xhr = xhr;
+                    reject(e);
+                    return;
+                }
+                let error = BINARY_ERRORS[header.getUint32(4, true)];
+                if (error !== undefined) {
+                    reject(new Error(error));
+                    return;
+                }
+                resolve(new Uint8ClampedArray(xhr.response, BINARY_RESPONSE_SIZE));
+            });
+            xhr.addEventListener('error' ,(e) => {
+                e.xhr = xhr;
+                reject(e);
+            });
+            xhr.send();
+        });
+    }
+
+    const MULTI_RESPONSE_SIZE = 8;
+    const MULTI_ENTRY_SIZE = 12;
+    const MULTI_MAGIC = 0x314d4b52; // RKM1
+
+    function decodeMultiResponse(buffer, names) {
+        let view = new DataView(buffer);
+        if (view.getUint32(0, true) !== MULTI_MAGIC) {
+            throw new Error('Invalid captureMulti response');
+        }
+
+        let out = {};
+        let count = view.getUint32(4, true);
+        for (let i = 0; i < count; i++) {
+            let entry = MULTI_RESPONSE_SIZE + i * MULTI_ENTRY_SIZE;
+            let offset = view.getUint32(entry, true);
+            let width = view.getUint32(entry + 4, true);
+            let height = view.getUint32(entry + 8, true);
+
+            if (width === 0 || height === 0) {
+                out[names[i]] = null;
+            } else {
+                out[names[i]] = new Uint8ClampedArray(buffer, offset, width * height * 4);
+            }
+        }
+        return out;
+    }
+
     function emit(param){
         let listeners = alt1.events[param.eventName];
         for(let i = 0; i < listeners.length; i++){
@@ -321,60 +402,82 @@
         getRegion(x, y, w, h) {
             return syncRpc({func: 'getRegion', x: x, y: y, w: w, h: h});
         },
-        // getRegionMulti(rectsjson) {
-        //     return '';
-        // },
-        bindRegion(x, y, w, h) {
-            return syncRpc({func: 'bindRegion', x: x, y: y, w: w, h: h}, true);
+        getRegionChanged(x, y, w, h) {
+            // RuneKit extension: {changed, bbox: {x, y, w, h} or null} since the
+            // last call with the same region
+            return syncRpc({func: 'getRegionChanged', x: x, y: y, w: w, h: h}, true);
+        },
+        async getRegionChangedAsync(x, y, w, h) {
+            return JSON.parse(await asyncRpc({func: 'getRegionChanged', x: x, y: y, w: w, h: h}));
+        },
+        getRegionMulti(rectsjson) {
+            return syncRpc({func: 'getRegionMulti', rects: JSON.parse(rectsjson)});
+        },
+        bindRegion(x, y, w, h, keep=false) {
+            // RuneKit extension: keep the region alongside later binds until bindRelease
+            return syncRpc({func: 'bindRegion', x: x, y: y, w: w, h: h, keep: keep}, true);
+        },
+        bindScreenRegion(x, y, w, h, keep=false) {
+            return syncRpc({func: 'bindScreenRegion', x: x, y: y, w: w, h: h, keep: keep}, true);
+        },
+        bindRelease(id) {
+            // RuneKit extension: free a region bound with keep
+            return syncRpc({func: 'bindRelease', id: id}, true);
         },
-        // bindScreenRegion(x, y, w, h) {
-        //     return -1;
-        // },
         bindGetRegion(id, x, y, w, h) {
             return syncRpc({func: 'bindGetRegion', id: id, x: x, y: y, w: w, h: h});
         },
-        // bindReadString(id, fontname, x, y) {
-        //     return '';
-        // },
-        // bindReadColorString(id, fontname, color, x, y) {
-        //     return '';
-        // },
-        // // TODO: Used in AfkScape
-        // bindReadStringEx(id, x, y, args) {
-        //     return '';
-        // },
+        bindReadString(id, fontname, x, y) {
+            return syncRpc({func: 'bindReadString', id: id, fontname: fontname, x: x, y: y}, true).text || '';
+        },
+        bindReadColorString(id, fontname, color, x, y) {
+            return syncRpc({func: 'bindReadColorString', id: id, fontname: fontname, color: color, x: x, y: y}, true).text || '';
+        },
+        bindReadStringEx(id, x, y, args) {
+            return JSON.stringify(syncRpc({func: 'bindReadStringEx', id: id, x: x, y: y, args: args}, true));
+        },
+        bindColorStats(id, x, y, w, h, args) {
+            // RuneKit extension: args is JSON of
+            // {colors: [int], tolerance: int, projections: bool, dominant: int}.
+            // Returns {total, counts, rows, columns, dominant: [{color, count}]}
+            return syncRpc({func: 'bindColorStats', id: id, x: x, y: y, w: w, h: h, args: args}, true);
+        },
         // bindReadRightClickString(id, x, y) {
         //     return '';
         // },
-        // bindGetPixel(id, x, y) {
-        //     return -1;
-        // },
-        // bindFindSubImg(id, imgstr, imgwidth, x, y, w, h) {
-        //     return '';
-        // },
+        bindGetPixel(id, x, y) {
+            return syncRpc({func: 'bindGetPixel', id: id, x: x, y: y}, true);
+        },
+        bindGetPixels(id, points) {
+            // RuneKit extension: read many [x, y] points in one call
+            return syncRpc({func: 'bindGetPixels', id: id, points: points}, true);
+        },
+        bindFindSubImg(id, imgstr, imgwidth, x, y, w, h) {
+            return syncRpc({func: 'bindFindSubImg', id: id, imgstr: imgstr, imgwidth: imgwidth, x: x, y: y, w: w, h: h});
+        },
         capture(x, y, w, h) {
+            // Sync XHR cannot return an ArrayBuffer, use captureAsync when possible
             let data = syncRpc({func: 'getRegionRaw', x: x, y: y, w: w, h: h});
             return str2ab(data);
         },
         captureAsync(x, y, w, h) {
-            return asyncRpc({func: 'getRegionRaw', x: x, y: y, w: w, h: h}, 'arraybuffer')
-                .then((data) => new Uint8ClampedArray(data));
+            return binaryRpc('getRegionRaw', 0, x, y, w, h);
         },
         async captureMultiAsync(areas) {
-            // XXX: This override the current bind
-            let boundId = await asyncRpc({func: 'bindRegion', x: 0, y: 0, w: alt1.rsWidth, h: alt1.rsHeight}, 'json');
-            let bounds = await Promise.all(Object.keys(areas).map((area) => {
-                let value = areas[area];
-                return asyncRpc({func: 'bindGetRegionRaw', id: boundId, x: value.x, y: value.y, w: value.width, h: value.height}, 'arraybuffer')
-                    .then((data) => ({[area]: new Uint8ClampedArray(data)}));
-            }));
-            return bounds.reduce((a, b) => ({...a, ...b}), {});
+            let data = await asyncRpc({func: 'captureMulti', areas: areas}, 'arraybuffer');
+            return decodeMultiResponse(data, Object.keys(areas));
         },
         bindGetRegionBuffer(id, x, y, w, h) {
+            // Sync XHR cannot return an ArrayBuffer, use bindGetRegionBufferAsync when possible
             let data = syncRpc({func: 'bindGetRegionRaw', id: id, x: x, y: y, w: w, h: h});
             return str2ab(data);
         },
-        addOCRFont(){
+        bindGetRegionBufferAsync(id, x, y, w, h) {
+            // RuneKit extension: resolves to the RGBA pixels as a Uint8ClampedArray
+            return binaryRpc('bindGetRegionRaw', id, x, y, w, h);
+        },
+        addOCRFont(name, fontjson) {
+            return syncRpc({func: 'addOCRFont', name: name, fontjson: fontjson}, true);
         },
     };
 
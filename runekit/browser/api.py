@@ -2,7 +2,15 @@ import base64
 import json
 import logging
 import secrets
-from typing import TYPE_CHECKING, Dict, Callable, List, NamedTuple
+import time
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Callable,
+    Optional,
+    Tuple,
+    Union,
+)
 from urllib.parse import urljoin
 
 from PySide2.QtCore import (
@@ -22,32 +30,56 @@ from PySide2.QtGui import QGuiApplication, QCursor, QScreen
 from PySide2.QtWebChannel import QWebChannel
 from PySide2.QtWebEngineCore import QWebEngineUrlSchemeHandler, QWebEngineUrlRequestJob
 
+from runekit.alt1.schema import CaptureMulti
 from runekit.browser.overlay import OverlayApi
+from runekit.browser.regions import BoundedRegion, BoundRegionTable, ChangeTracker
 from runekit.browser.utils import (
     ApiPermissionDeniedException,
     image_to_stream,
     encode_mouse,
+    encode_pixel,
+    encode_pixels,
     decode_image,
+    decode_binary_request,
+    encode_binary_error,
+    pack_binary_header,
+    RgbaEncoder,
+    BINARY_FORMAT_NOT_BOUND,
+    BINARY_FORMAT_TOO_LARGE,
+    BINARY_RESPONSE,
+    BINARY_RPC_PREFIX,
+    BINARY_GET_REGION_RAW,
+    BINARY_BIND_GET_REGION_RAW,
 )
 from runekit.game.instance import ImageType
+from runekit.image import (
+    find_subimage,
+    color_stats,
+    dominant_colors,
+    OCRFont,
+    decode_rgb,
+)
+from runekit.image.np_utils import np_crop, ensure_np_image
+from runekit.metrics import metrics
 from runekit.ui.tray import tray_icon
 
 if TYPE_CHECKING:
     from runekit.app.app import App
 
 
-class BoundedRegion(NamedTuple):
-    image: ImageType
-
-
 class Alt1Api(QObject):
     app: "App"
     rpc_funcs: Dict[str, Callable]
+    binary_rpc_funcs: Dict[int, Callable]
 
     alt1Signal = Signal(int)
 
     _screen_info: QRect
-    _bound_regions: List[BoundedRegion]
+    _bound_regions: BoundRegionTable
+    _changes: ChangeTracker
+    _ocr_fonts: Dict[str, OCRFont]
+    _region_cache: Optional[Tuple[tuple, bytes]] = None
+    _encoder: RgbaEncoder
     _game_active = False
     _game_position: QRect
     _game_scaling: float
@@ -56,7 +88,10 @@ class Alt1Api(QObject):
     def __init__(self, app, **kwargs):
         super().__init__(**kwargs)
         self.app = app
-        self._bound_regions = []
+        self._bound_regions = BoundRegionTable()
+        self._changes = ChangeTracker()
+        self._ocr_fonts = {}
+        self._encoder = RgbaEncoder()
         self._overlay = OverlayApi(self, parent=self)
         self.logger = logging.getLogger(
             __name__
@@ -69,9 +104,27 @@ class Alt1Api(QObject):
         self.rpc_funcs = {
             "getRegion": self.get_region,
             "getRegionRaw": self.get_region_raw,
+            "getRegionMulti": self.get_region_multi,
+            "getRegionChanged": self.get_region_changed,
+            "captureMulti": self.capture_multi,
             "bindRegion": self.bind_region,
+            "bindScreenRegion": self.bind_screen_region,
+            "bindRelease": self.bind_release,
             "bindGetRegion": self.bind_get_region,
             "bindGetRegionRaw": self.bind_get_region_raw,
+            "bindGetPixel": self.bind_get_pixel,
+            "bindGetPixels": self.bind_get_pixels,
+            "bindFindSubImg": self.bind_find_sub_img,
+            "bindReadString": self.bind_read_string,
+            "bindReadColorString": self.bind_read_color_string,
+            "bindReadStringEx": self.bind_read_string_ex,
+            "bindColorStats": self.bind_color_stats,
+            "addOCRFont": self.add_ocr_font,
+        }
+        # Binary RPC functions are called with (id, x, y, w, h)
+        self.binary_rpc_funcs = {
+            BINARY_GET_REGION_RAW: self.binary_get_region_raw,
+            BINARY_BIND_GET_REGION_RAW: self.binary_bind_get_region_raw,
         }
 
         self._update_screen_info()
@@ -102,6 +155,58 @@ class Alt1Api(QObject):
 
     screen_update_signal = Signal()
 
+    def _cache_region(self, key: tuple, encode: Callable[[ImageType], bytes]):
+        """Reuse the last encoded region if the game frame has not changed since"""
+        frame = self.app.game_instance.capture.get_frame()
+        key = (*key, frame.version)
+
+        cached = self._region_cache
+        if cached is not None and cached[0] == key:
+            metrics.cache("encode.region", True)
+            return cached[1]
+
+        metrics.cache("encode.region", False)
+        out = encode(frame.image)
+        self._region_cache = (key, out)
+        return out
+
+    def _get_bound_region(self, id: int, func: str) -> Optional[BoundedRegion]:
+        if id == 0:
+            return None
+
+        region = self._bound_regions.get(id)
+        if region is None:
+            self.logger.warning("%s(%d) but image not bound", func, id)
+
+        return region
+
+    def _read_string(self, id, fontname, x, y, func, **kwargs):
+        if not self.app.has_permission("pixel"):
+            raise ApiPermissionDeniedException("pixel")
+
+        image = self._get_bound_region(id, func)
+        if image is None:
+            return {}
+
+        font = self._ocr_fonts.get(fontname)
+        if font is None:
+            self.logger.warning("%s font %s is not loaded", func, fontname)
+            return {}
+
+        result = font.read_line(ensure_np_image(image.image), x, y, **kwargs)
+        if result is None:
+            return {}
+
+        return {
+            "text": result.text,
+            "debugArea": {
+                "x": result.x,
+                "y": result.y,
+                "w": result.width,
+                "h": result.height,
+            },
+        }
+
     # endregion
 
     # region Qt Properties
@@ -128,9 +233,12 @@ class Alt1Api(QObject):
     )
 
     def get_capture_interval(self):
-        return self.app.game_instance.refresh_rate
+        return self.app.game_instance.capture.scheduler.get_interval()
 
-    captureInterval = Property(int, get_capture_interval, constant=True)
+    capture_interval_signal = Signal()
+    captureInterval = Property(
+        int, get_capture_interval, notify=capture_interval_signal
+    )
 
     def get_mouse_position(self):
         if not self.app.has_permission("gamestate"):
@@ -205,38 +313,90 @@ class Alt1Api(QObject):
         if not self.app.has_permission("pixel"):
             raise ApiPermissionDeniedException("pixel")
 
-        return base64.b64encode(
-            image_to_stream(self.app.game_instance.grab_region(x, y, w, h))
+        return self._cache_region(
+            ("getRegion", x, y, w, h),
+            lambda image: base64.b64encode(image_to_stream(image, x, y, w, h)),
         )
 
     def get_region_raw(self, x, y, w, h):
         if not self.app.has_permission("pixel"):
             raise ApiPermissionDeniedException("pixel")
 
-        return image_to_stream(
-            self.app.game_instance.grab_region(x, y, w, h), mode="rgba"
+        return self._cache_region(
+            ("getRegionRaw", x, y, w, h),
+            lambda image: self._encoder.encode(image, x, y, w, h) or b"",
         )
 
-    def bind_region(self, x, y, w, h):
+    def get_region_changed(self, x, y, w, h):
+        if not self.app.has_permission("pixel"):
+            raise ApiPermissionDeniedException("pixel")
+
+        frame = self.app.game_instance.capture.get_frame()
+        change = self._changes.check(frame, x, y, w, h)
+        if change.bbox is None:
+            return {"changed": change.changed, "bbox": None}
+
+        bx, by, bw, bh = change.bbox
+        return {
+            "changed": change.changed,
+            "bbox": {"x": bx, "y": by, "w": bw, "h": bh},
+        }
+
+    def get_region_multi(self, rects):
+        if not self.app.has_permission("pixel"):
+            raise ApiPermissionDeniedException("pixel")
+
+        if isinstance(rects, dict):
+            rects = rects.values()
+
+        image = self.app.game_instance.capture.get_frame().image
+        out = []
+        for rect in rects:
+            try:
+                x, y, w, h = rect["x"], rect["y"], rect["width"], rect["height"]
+            except (TypeError, KeyError):
+                # Entries are decoded by position, keep an empty one in place
+                out.append(b"")
+                continue
+
+            out.append(image_to_stream(image, x, y, w, h))
+
+        return base64.b64encode(b"".join(out))
+
+    def capture_multi(self, areas: CaptureMulti):
+        if not self.app.has_permission("pixel"):
+            raise ApiPermissionDeniedException("pixel")
+
+        # All areas are cropped from the same frame
+        image = self.app.game_instance.capture.get_frame().image
+        return self._encoder.encode_multi(image, list(areas.values()))
+
+    def bind_region(self, x, y, w, h, keep=False):
+        if not self.app.has_permission("pixel"):
+            return 0
+
+        # Binds of the same tick share the frame
+        frame = self.app.game_instance.capture.get_frame()
+        return self._bound_regions.bind(
+            frame.image, x, y, w, h, keep=keep, version=frame.version
+        )
+
+    def bind_screen_region(self, x, y, w, h, keep=False):
         if not self.app.has_permission("pixel"):
             return 0
 
-        # Alt1 only support one region
-        bound_data = self.app.game_instance.grab_region(x, y, w, h)
-        self._bound_regions = [BoundedRegion(image=bound_data)]
-        return 1
+        bound_data = self.app.game_instance.grab_desktop(x, y, w, h)
+        return self._bound_regions.bind(bound_data, keep=keep)
+
+    def bind_release(self, id):
+        return self._bound_regions.release(id)
 
     def bind_get_region(self, id, x, y, w, h):
         if not self.app.has_permission("pixel"):
             raise ApiPermissionDeniedException("pixel")
 
-        if id == 0:
-            return ""
-
-        try:
-            image = self._bound_regions[id - 1]
-        except IndexError:
-            self.logger.warning("bindGetRegion(%d) but image not bound", id)
+        image = self._get_bound_region(id, "bindGetRegion")
+        if image is None:
             return ""
 
         return base64.b64encode(image_to_stream(image.image, x, y, w, h))
@@ -245,16 +405,126 @@ class Alt1Api(QObject):
         if not self.app.has_permission("pixel"):
             raise ApiPermissionDeniedException("pixel")
 
-        if id == 0:
+        image = self._get_bound_region(id, "bindGetRegionRaw")
+        if image is None:
             return ""
 
-        try:
-            image = self._bound_regions[id - 1]
-        except IndexError:
-            self.logger.warning("bindGetRegionRaw(%d) but image not bound", id)
+        return self._encoder.encode(image.image, x, y, w, h, ignore_limit=True)
+
+    def bind_get_pixel(self, id, x, y):
+        if not self.app.has_permission("pixel"):
+            raise ApiPermissionDeniedException("pixel")
+
+        image = self._get_bound_region(id, "bindGetPixel")
+        if image is None:
+            return -1
+
+        return encode_pixel(ensure_np_image(image.image), x, y)
+
+    def bind_get_pixels(self, id, points):
+        if not self.app.has_permission("pixel"):
+            raise ApiPermissionDeniedException("pixel")
+
+        image = self._get_bound_region(id, "bindGetPixels")
+        if image is None:
+            return [-1] * len(points)
+
+        return encode_pixels(ensure_np_image(image.image), points)
+
+    def bind_find_sub_img(self, id, imgstr, imgwidth, x, y, w, h):
+        if not self.app.has_permission("pixel"):
+            raise ApiPermissionDeniedException("pixel")
+
+        image = self._get_bound_region(id, "bindFindSubImg")
+        if image is None:
             return ""
 
-        return image_to_stream(image.image, x, y, w, h, mode="rgba", ignore_limit=True)
+        haystack = np_crop(ensure_np_image(image.image), x, y, w, h)
+        needle = decode_image(imgstr, imgwidth)
+
+        return [
+            {"x": match_x + x, "y": match_y + y}
+            for match_x, match_y in find_subimage(haystack, needle)
+        ]
+
+    def bind_read_string(self, id, fontname, x, y):
+        return self._read_string(id, fontname, x, y, "bindReadString")
+
+    def bind_read_color_string(self, id, fontname, color, x, y):
+        return self._read_string(
+            id, fontname, x, y, "bindReadColorString", colors=[decode_rgb(color)]
+        )
+
+    def bind_read_string_ex(self, id, x, y, args):
+        args = json.loads(args)
+        kwargs = {"allow_gap": args.get("allowgap", True)}
+        if args.get("colors"):
+            kwargs["colors"] = [decode_rgb(color) for color in args["colors"]]
+
+        return self._read_string(
+            id, args.get("fontname"), x, y, "bindReadStringEx", **kwargs
+        )
+
+    def bind_color_stats(self, id, x, y, w, h, args):
+        if not self.app.has_permission("pixel"):
+            raise ApiPermissionDeniedException("pixel")
+
+        image = self._get_bound_region(id, "bindColorStats")
+        if image is None:
+            return {}
+
+        args = json.loads(args)
+        region = np_crop(ensure_np_image(image.image), x, y, w, h)
+        stats = color_stats(
+            region,
+            [decode_rgb(color) for color in args.get("colors", [])],
+            args.get("tolerance", 0),
+            args.get("projections", False),
+        )
+        out = stats._asdict()
+
+        if args.get("dominant"):
+            out["dominant"] = [
+                {"color": color, "count": count}
+                for color, count in dominant_colors(region, args["dominant"])
+            ]
+
+        return out
+
+    def add_ocr_font(self, name, fontjson):
+        self._ocr_fonts[name] = OCRFont(json.loads(fontjson))
+        return True
+
+    # endregion
+
+    # region Binary RPC handlers
+    def binary_get_region_raw(self, id, x, y, w, h):
+        if not self.app.has_permission("pixel"):
+            raise ApiPermissionDeniedException("pixel")
+
+        def encode(image):
+            out = self._encoder.encode(
+                image, x, y, w, h, header_size=BINARY_RESPONSE.size
+            )
+            if out is None:
+                return encode_binary_error(BINARY_FORMAT_TOO_LARGE)
+
+            return pack_binary_header(out, w, h)
+
+        return self._cache_region(("bin.getRegionRaw", x, y, w, h), encode)
+
+    def binary_bind_get_region_raw(self, id, x, y, w, h):
+        if not self.app.has_permission("pixel"):
+            raise ApiPermissionDeniedException("pixel")
+
+        image = self._get_bound_region(id, "bindGetRegionRaw")
+        if image is None:
+            return encode_binary_error(BINARY_FORMAT_NOT_BOUND)
+
+        out = self._encoder.encode(
+            image.image, x, y, w, h, header_size=BINARY_RESPONSE.size, ignore_limit=True
+        )
+        return pack_binary_header(out, w, h)
 
     # endregion
 
@@ -408,6 +678,9 @@ class Alt1ApiPrivate(QObject):
         self.api.app.game_instance.positionChanged.connect(self.on_game_position_change)
         self.api.app.game_instance.scalingChanged.connect(self.on_game_scaling_change)
         self.api.app.game_instance.alt1_pressed.connect(self.on_alt1)
+        self.api.app.game_instance.capture.scheduler.intervalChanged.connect(
+            self.on_capture_interval_change
+        )
 
     @Slot(QScreen)
     def on_screen_update(self, _):
@@ -428,6 +701,10 @@ class Alt1ApiPrivate(QObject):
         self.api._game_scaling = scale
         self.api.game_scaling_change_signal.emit()
 
+    @Slot(int)
+    def on_capture_interval_change(self, _):
+        self.api.capture_interval_signal.emit()
+
     @Slot()
     def on_alt1(self):
         mouse = self.api.get_mouse_position()
@@ -444,7 +721,7 @@ class Alt1WebChannel(QWebChannel):
 
 
 class RuneKitRequestProcessSignals(QObject):
-    successSignal = Signal(QWebEngineUrlRequestJob, bytes, bytes)
+    successSignal = Signal(QWebEngineUrlRequestJob, bytes, QByteArray)
 
 
 class RuneKitRequestProcess(QRunnable):
@@ -460,9 +737,16 @@ class RuneKitRequestProcess(QRunnable):
         self.signals = RuneKitRequestProcessSignals(parent=self.request)
 
     def run(self):
+        self.start = time.perf_counter()
         try:
             url = self.request.requestUrl()
-            data = json.loads(url.path())
+            path = url.path()
+
+            if path.startswith(BINARY_RPC_PREFIX):
+                self.run_binary(path[len(BINARY_RPC_PREFIX) :])
+                return
+
+            data = json.loads(path)
 
             func = data["func"]
             del data["func"]
@@ -471,18 +755,13 @@ class RuneKitRequestProcess(QRunnable):
             out = self.handler.api.rpc_funcs[func](**data)
 
             if isinstance(out, str):
-                self.signals.successSignal.emit(
-                    self.request, b"text/plain", out.encode("utf-8")
-                )
-            elif isinstance(out, bytes):
-                self.signals.successSignal.emit(
-                    self.request, b"application/octet-stream", out
-                )
+                self.reply(func, b"text/plain", out.encode("utf-8"))
+            elif isinstance(out, (bytes, bytearray)):
+                self.reply(func, b"application/octet-stream", out)
             else:
-                self.signals.successSignal.emit(
-                    self.request, b"application/json", json.dumps(out).encode("ascii")
-                )
+                self.reply(func, b"application/json", json.dumps(out).encode("ascii"))
         except:
+            metrics.increment("rpc.errors")
             self.request.fail(QWebEngineUrlRequestJob.RequestFailed)
             self.handler.logger.error(
                 "Fail to handle request %s",
@@ -490,6 +769,19 @@ class RuneKitRequestProcess(QRunnable):
                 exc_info=True,
             )
 
+    def run_binary(self, request: str):
+        func, args = decode_binary_request(request)
+        self.handler.logger.debug("Binary RPC: %d%s", func, repr(args))
+
+        out = self.handler.api.binary_rpc_funcs[func](*args)
+        self.reply("bin.%d" % func, b"application/octet-stream", out)
+
+    def reply(self, func: str, content_type: bytes, body: Union[bytes, bytearray]):
+        metrics.increment("rpc.bytes", len(body))
+        metrics.observe("rpc." + func, (time.perf_counter() - self.start) * 1000)
+        # The response is copied once here, so encoders may hand out buffers
+        self.signals.successSignal.emit(self.request, content_type, QByteArray(body))
+
 
 class RuneKitSchemeHandler(QWebEngineUrlSchemeHandler):
     api: Alt1Api
@@ -513,7 +805,7 @@ class RuneKitSchemeHandler(QWebEngineUrlSchemeHandler):
         processor.signals.successSignal.connect(self.on_success)
         self.thread_pool.start(processor)
 
-    @Slot(QWebEngineUrlRequestJob, bytes, bytes)
+    @Slot(QWebEngineUrlRequestJob, bytes, QByteArray)
     def on_success(self, request, content_type, reply):
         body = QBuffer(parent=request)
         body.setData(reply)
@@ -0,0 +1,251 @@
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from runekit.game.instance import ImageType
+from runekit.image import diff_bbox
+from runekit.image.np_utils import ensure_np_image, np_crop
+from runekit.metrics import metrics
+
+BOUND_REGION_BUDGET = 64 * 2**20
+"""Bytes of frames kept by bound regions per app before the least recently used
+region is evicted. Each frame counts once, however many regions share it"""
+MAX_BOUND_REGIONS = 16
+MAX_CHANGE_CURSORS = 64
+"""Regions polled for changes that are remembered per app"""
+
+if TYPE_CHECKING:
+    from runekit.game.capture import Frame
+
+
+class BoundedRegion:
+    """Rectangle of a bound frame. Frames are never modified once captured,
+    so binds share the frame instead of copying their region out of it.
+    Kept regions survive later binds until released or evicted"""
+
+    __slots__ = ("frame", "key", "x", "y", "width", "height", "keep", "_image")
+
+    def __init__(
+        self,
+        frame: ImageType,
+        key: Hashable,
+        x: int,
+        y: int,
+        width: int,
+        height: int,
+        keep=False,
+    ):
+        self.frame = frame
+        self.key = key
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.keep = keep
+        self._image = None
+
+    @property
+    def image(self) -> ImageType:
+        """The region as an image. A view of the frame unless it is padded"""
+        if self._image is None:
+            if isinstance(self.frame, np.ndarray):
+                self._image = np_crop(
+                    self.frame, self.x, self.y, self.width, self.height
+                )
+            else:
+                self._image = self.frame.crop(
+                    (self.x, self.y, self.x + self.width, self.y + self.height)
+                )
+
+        return self._image
+
+
+def image_size(image: ImageType) -> int:
+    if isinstance(image, np.ndarray):
+        return image.nbytes
+
+    return image.width * image.height * len(image.getbands())
+
+
+def own_frame(image: ImageType) -> ImageType:
+    """Return image, or a copy of it if it is a view of memory owned by someone
+    else. Frames may be views of shm segments that the capture ring wants back"""
+    if isinstance(image, np.ndarray) and not image.flags.owndata:
+        out = np.array(image)
+        out.flags.writeable = False
+        return out
+
+    return image
+
+
+class BoundRegionTable:
+    """Bound regions of an app, addressed by handle.
+
+    Like Alt1, a bind replaces the previous one. Regions bound with keep opt in
+    to stay alongside later binds until they are released, or evicted in least
+    recently used order once over budget.
+
+    Regions are views of a frame store. Binds of the same frame version share one
+    frame, copied out of shm at most once, and reference counted by the regions
+    bound to it. Each frame counts once against the budget.
+
+    Handles start at 1 and are never reused, so a reader holding an evicted or
+    released handle gets nothing instead of another reader's image. Thread safe,
+    as RPCs run on a thread pool."""
+
+    def __init__(self, budget=BOUND_REGION_BUDGET, max_regions=MAX_BOUND_REGIONS):
+        self.budget = budget
+        self.max_regions = max_regions
+        self._lock = threading.Lock()
+        self._regions: "OrderedDict[int, BoundedRegion]" = OrderedDict()
+        self._frames: Dict[Hashable, List] = {}
+        """key -> [frame, size, bound regions]"""
+        self._next_id = 1
+        self._size = 0
+
+    def bind(
+        self,
+        image: ImageType,
+        x=0,
+        y=0,
+        width: int = None,
+        height: int = None,
+        keep=False,
+        version: Optional[int] = None,
+    ) -> int:
+        """Bind a rectangle of image, or all of it. Binds of the same frame
+        version share the frame"""
+        if width is None or height is None:
+            if isinstance(image, np.ndarray):
+                height, width = image.shape[:2]
+            else:
+                width, height = image.size
+
+        with self._lock:
+            id = self._next_id
+            self._next_id += 1
+
+            # Images without a version are never shared
+            key = ("frame", version) if version is not None else ("image", id)
+            frame = self._acquire_frame(key, image)
+            region = BoundedRegion(frame, key, x, y, width, height, keep)
+
+            for replaced in [i for i, r in self._regions.items() if not r.keep]:
+                self._release_frame(self._regions.pop(replaced).key)
+
+            self._regions[id] = region
+
+            # The region just bound is always kept, even if over budget
+            while len(self._regions) > 1 and (
+                self._size > self.budget or len(self._regions) > self.max_regions
+            ):
+                _, evicted = self._regions.popitem(last=False)
+                self._release_frame(evicted.key)
+                metrics.increment("bound.evicted")
+
+        return id
+
+    def get(self, id: int) -> Optional[BoundedRegion]:
+        with self._lock:
+            region = self._regions.get(id)
+            if region is not None:
+                self._regions.move_to_end(id)
+
+            return region
+
+    def release(self, id: int) -> bool:
+        with self._lock:
+            region = self._regions.pop(id, None)
+            if region is None:
+                return False
+
+            self._release_frame(region.key)
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._regions.clear()
+            self._frames.clear()
+            self._size = 0
+
+    def __len__(self):
+        return len(self._regions)
+
+    @property
+    def size(self) -> int:
+        """Bytes of frames currently kept by bound regions"""
+        return self._size
+
+    def _acquire_frame(self, key: Hashable, image: ImageType) -> ImageType:
+        entry = self._frames.get(key)
+        metrics.cache("bound.frame", entry is not None)
+
+        if entry is None:
+            with metrics.time("crop.bind_region"):
+                frame = own_frame(image)
+
+            entry = self._frames[key] = [frame, image_size(frame), 0]
+            self._size += entry[1]
+
+        entry[2] += 1
+        return entry[0]
+
+    def _release_frame(self, key: Hashable):
+        entry = self._frames[key]
+        entry[2] -= 1
+        if entry[2] == 0:
+            del self._frames[key]
+            self._size -= entry[1]
+
+
+class RegionChange(NamedTuple):
+    changed: bool
+    bbox: Optional[Tuple[int, int, int, int]]
+    """(x, y, width, height) of the changed pixels, in game coordinates"""
+
+
+class ChangeTracker:
+    """Remember what an app last saw of each region it polls for changes.
+
+    A cursor holds the frame version and a copy of the region pixels, so a
+    region is only compared when the frame changed, and pinning whole frames
+    (and their shm segments) is avoided."""
+
+    def __init__(self, max_cursors=MAX_CHANGE_CURSORS):
+        self.max_cursors = max_cursors
+        self._lock = threading.Lock()
+        self._cursors: "OrderedDict[tuple, Tuple[int, np.ndarray]]" = OrderedDict()
+
+    def check(self, frame: "Frame", x: int, y: int, w: int, h: int) -> RegionChange:
+        """Return whether the region changed since the last check of the same
+        region. The first check of a region always reports all of it"""
+        key = (x, y, w, h)
+        with self._lock:
+            cursor = self._cursors.get(key)
+            if cursor is not None:
+                self._cursors.move_to_end(key)
+
+        if cursor is not None and cursor[0] == frame.version:
+            metrics.cache("change.version", True)
+            return RegionChange(changed=False, bbox=None)
+
+        metrics.cache("change.version", False)
+        pixels = np.array(np_crop(ensure_np_image(frame.image), x, y, w, h))
+
+        if cursor is None:
+            bbox = (0, 0, w, h)
+        else:
+            bbox = diff_bbox(cursor[1], pixels)
+
+        with self._lock:
+            self._cursors[key] = (frame.version, pixels)
+            while len(self._cursors) > self.max_cursors:
+                self._cursors.popitem(last=False)
+
+        if bbox is None:
+            return RegionChange(changed=False, bbox=None)
+
+        bx, by, bw, bh = bbox
+        return RegionChange(changed=True, bbox=(bx + x, by + y, bw, bh))
@@ -1,14 +1,43 @@
 import base64
-from typing import TypeVar
+import struct
+import sys
+import threading
+from typing import List, Optional, Tuple, TypeVar, Union
 
+import cv2
 import numpy as np
 from PIL import Image
 from PySide2.QtGui import QColor
 
 from runekit.game.instance import ImageType
-from runekit.image.np_utils import np_crop
+from runekit.image.np_utils import CropRegion, ensure_np_image
+from runekit.metrics import metrics
 
 TRANSFER_LIMIT = 4_000_000
+ENCODE_BUFFERS = 2
+"""Output buffers kept per thread, so one held by the region cache does not
+prevent reusing another"""
+
+BINARY_RPC_PREFIX = "bin/"
+BINARY_REQUEST = struct.Struct("<B3xIiiii")
+"""func, bound id, x, y, width, height"""
+BINARY_RESPONSE = struct.Struct("<4sIII")
+"""magic, format, width, height. Followed by the pixels"""
+BINARY_MAGIC = b"RKB1"
+BINARY_FORMAT_NOT_BOUND = 0
+"""No pixels follow, the requested region is not bound"""
+BINARY_FORMAT_RGBA = 1
+BINARY_FORMAT_TOO_LARGE = 2
+"""No pixels follow, the requested region is over TRANSFER_LIMIT"""
+
+BINARY_GET_REGION_RAW = 1
+BINARY_BIND_GET_REGION_RAW = 2
+
+MULTI_RESPONSE = struct.Struct("<4sI")
+"""magic, region count. Followed by an offset table of MULTI_ENTRY"""
+MULTI_ENTRY = struct.Struct("<III")
+"""offset from start of response, width, height"""
+MULTI_MAGIC = b"RKM1"
 
 
 class ApiPermissionDeniedException(Exception):
@@ -49,6 +78,21 @@ def ensure_image_bgra(image: ImgTypeG) -> ImgTypeG:
         return image
 
 
+def copy_bgra_to_rgba(dst: np.ndarray, src: np.ndarray):
+    cv2.cvtColor(src, cv2.COLOR_BGRA2RGBA, dst=dst)
+
+
+REGION_COPY = {"bgra": np.copyto, "rgba": copy_bgra_to_rgba}
+"""CropRegion.write_into copy functions by output mode, from BGRA frames"""
+
+
+def region_buffer(region: CropRegion, out: bytearray, offset: int) -> np.ndarray:
+    """View of out at offset, shaped like region"""
+    return np.frombuffer(
+        out, dtype=region.dtype, count=region.size, offset=offset
+    ).reshape(region.shape)
+
+
 def ensure_image(image: ImgTypeG, mode: str) -> ImgTypeG:
     if mode == "rgba":
         return ensure_image_rgba(image)
@@ -66,10 +110,17 @@ def image_to_stream(
     height=None,
     mode="bgra",
     ignore_limit=False,
-) -> bytes:
+) -> Union[bytes, bytearray]:
     if isinstance(image, np.ndarray):
-        out = np_crop(image, x, y, width, height)
-        out = ensure_image(out, mode).tobytes()
+        copy = REGION_COPY.get(mode)
+        if copy is None:
+            raise ValueError("invalid mode")
+
+        with metrics.time("crop.image_to_stream"):
+            region = CropRegion(image, x, y, width, height)
+        with metrics.time("encode.image_to_stream"):
+            out = bytearray(region.size)
+            region.write_into(region_buffer(region, out, 0), copy)
     else:
         assert image.mode == "RGBA"
 
@@ -79,19 +130,160 @@ def image_to_stream(
             height = image.height
 
         if not ignore_limit and width * height * 4 > TRANSFER_LIMIT:
-            return ""
+            return b""
 
         image = image.crop((x, y, x + width, y + height))
 
         out = ensure_image(image, mode).tobytes()
 
+    metrics.increment("encode.bytes", len(out))
     return out
 
 
+class RgbaEncoder:
+    """Crop BGRA frames and swizzle them to RGBA in a single pass, straight into
+    the output buffer.
+
+    Each thread keeps its last ENCODE_BUFFERS output buffers and reuses one for
+    the next response of the same size, once nothing else references it."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def encode(
+        self,
+        image: ImageType,
+        x=0,
+        y=0,
+        width=None,
+        height=None,
+        header_size=0,
+        ignore_limit=False,
+    ) -> Optional[bytearray]:
+        """Encode a region with header_size bytes reserved in front. Return None
+        if a PIL region is over TRANSFER_LIMIT, like image_to_stream"""
+        if not ignore_limit and not isinstance(image, np.ndarray):
+            if width is None:
+                width = image.width
+            if height is None:
+                height = image.height
+            if width * height * 4 > TRANSFER_LIMIT:
+                return None
+
+        region = self._crop(image, x, y, width, height)
+        out = self._get_buffer(header_size + region.size)
+        self._swizzle(region, out, header_size)
+        return out
+
+    def encode_multi(self, image: ImageType, rects: List[dict]) -> bytearray:
+        """Encode rects of the same image as one MULTI_RESPONSE. Empty rects
+        become empty regions"""
+        regions = [
+            self._crop(image, rect["x"], rect["y"], rect["width"], rect["height"])
+            if rect
+            else None
+            for rect in rects
+        ]
+
+        offset = MULTI_RESPONSE.size + MULTI_ENTRY.size * len(regions)
+        size = offset + sum(region.size for region in regions if region is not None)
+        out = self._get_buffer(size)
+        MULTI_RESPONSE.pack_into(out, 0, MULTI_MAGIC, len(regions))
+
+        for index, region in enumerate(regions):
+            height, width = region.shape[:2] if region is not None else (0, 0)
+            MULTI_ENTRY.pack_into(
+                out,
+                MULTI_RESPONSE.size + MULTI_ENTRY.size * index,
+                offset,
+                width,
+                height,
+            )
+            if region is not None:
+                self._swizzle(region, out, offset)
+                offset += region.size
+
+        return out
+
+    def _get_buffer(self, size: int) -> bytearray:
+        pool = getattr(self._local, "buffers", None)
+        if pool is None:
+            pool = self._local.buffers = []
+
+        # Free buffers are referenced by the pool, buffer and getrefcount() only
+        for buffer in pool:
+            if len(buffer) == size and sys.getrefcount(buffer) == 3:
+                metrics.cache("encode.buffer", True)
+                return buffer
+
+        metrics.cache("encode.buffer", False)
+        out = bytearray(size)
+
+        # Replace a free buffer of another size, or the oldest one if all are held
+        for index, buffer in enumerate(pool):
+            if sys.getrefcount(buffer) == 3:
+                pool[index] = out
+                break
+        else:
+            pool.append(out)
+            del pool[:-ENCODE_BUFFERS]
+
+        return out
+
+    @staticmethod
+    def _crop(image: ImageType, x, y, width, height) -> CropRegion:
+        with metrics.time("crop.image_to_stream"):
+            if isinstance(image, np.ndarray):
+                return CropRegion(image, x, y, width, height)
+
+            # Convert only the region of PIL images, not the whole screen
+            if width is None:
+                width = image.width
+            if height is None:
+                height = image.height
+
+            image = image.crop((x, y, x + width, y + height))
+            return CropRegion(ensure_np_image(image), 0, 0, width, height)
+
+    @staticmethod
+    def _swizzle(region: CropRegion, out: bytearray, offset: int):
+        with metrics.time("encode.image_to_stream"):
+            if region.size:
+                region.write_into(region_buffer(region, out, offset), copy_bgra_to_rgba)
+
+        metrics.increment("encode.bytes", region.size)
+
+
 def encode_mouse(x: int, y: int) -> int:
     return (x << 16) | y
 
 
+def encode_pixel(image: np.ndarray, x: int, y: int) -> int:
+    """Read one BGRA pixel as Alt1 ARGB color, or -1 if out of bounds.
+    Colors are signed int32 like a1lib.mixColor"""
+    height, width = image.shape[:2]
+    if not (0 <= x < width and 0 <= y < height):
+        return -1
+
+    b, g, r = image[y, x, :3].tolist()
+    return -(1 << 32) + (0xFF000000 | (r << 16) | (g << 8) | b)
+
+
+def encode_pixels(image: np.ndarray, points: List[Tuple[int, int]]) -> List[int]:
+    """Batched encode_pixel for a list of (x, y)"""
+    points = np.asarray(points, dtype=np.intp).reshape(-1, 2)
+    xs = points[:, 0]
+    ys = points[:, 1]
+    height, width = image.shape[:2]
+    inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+
+    pixels = image[ys[inside], xs[inside], :3].astype(np.uint32)
+    colors = 0xFF000000 | (pixels[:, 2] << 16) | (pixels[:, 1] << 8) | pixels[:, 0]
+    out = np.full(len(points), -1, dtype=np.int32)
+    out[inside] = colors.view(np.int32)
+    return out.tolist()
+
+
 def decode_color(color: int) -> QColor:
     r = (color >> 16) & 0xFF
     g = (color >> 8) & 0xFF
@@ -105,3 +297,25 @@ def decode_image(img: str, width: int) -> np.ndarray:
     img = np.frombuffer(img, "<B")
     img.shape = (-1, width, 4)
     return img
+
+
+def decode_binary_request(data: str) -> Tuple[int, Tuple[int, int, int, int, int]]:
+    """Decode a binary RPC request from its url safe base64 form.
+    Return the function number and its arguments (id, x, y, w, h)"""
+    data = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+    func, *args = BINARY_REQUEST.unpack(data)
+    return func, tuple(args)
+
+
+def encode_binary_error(format_: int) -> bytes:
+    """Header only response for requests that have no pixels to return.
+    format_ tells why"""
+    return BINARY_RESPONSE.pack(BINARY_MAGIC, format_, 0, 0)
+
+
+def pack_binary_header(
+    out: bytearray, width: int, height: int, format_=BINARY_FORMAT_RGBA
+) -> bytearray:
+    """Fill the header of a response encoded with BINARY_RESPONSE.size reserved"""
+    BINARY_RESPONSE.pack_into(out, 0, BINARY_MAGIC, format_, width, height)
+    return out
@@ -0,0 +1,325 @@
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING, NamedTuple, Optional
+
+import numpy as np
+from PySide2.QtCore import QObject, QSettings, QThread, QTimer, Signal, Slot
+
+from runekit.metrics import metrics
+
+if TYPE_CHECKING:
+    from .instance import GameInstance, ImageType
+
+MIN_CAPTURE_INTERVAL = 10
+"""Fastest capture interval in ms that can be configured"""
+MAX_CAPTURE_INTERVAL = 10000
+"""Slowest idle capture interval in ms that can be configured"""
+
+
+class CaptureError(RuntimeError):
+    pass
+
+
+class Frame(NamedTuple):
+    image: "ImageType"
+    """The captured game image. Must not be modified"""
+    version: int
+    timestamp: float
+
+
+class CaptureScheduler(QObject):
+    """Adapt the capture interval to how busy the apps and the game are.
+
+    While apps keep requesting frames and the player is active in a focused game
+    the interval drops to min_interval. Once nobody asked for a frame for a while,
+    or the game lost focus, it backs off toward idle_interval.
+
+    Both are read from the settings on every update, so changes apply live."""
+
+    instance: "GameInstance"
+    active_timeout = 2.0
+    """Seconds since the last frame request during which apps are considered active"""
+    idle_timeout = 30.0
+    """Seconds of inactivity before reaching idle_interval"""
+    update_interval = 1000
+
+    intervalChanged = Signal(int)
+    _wake = Signal()
+
+    _last_request = 0.0
+
+    def __init__(self, instance: "GameInstance", **kwargs):
+        super().__init__(**kwargs)
+        self.instance = instance
+
+        self._settings = QSettings(self)
+        self._interval = self.instance.refresh_rate
+
+        self._wake.connect(self.update)
+        self.instance.focusChanged.connect(self.update)
+        self.instance.game_activity.connect(self.update)
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(self.update_interval)
+        self._timer.timeout.connect(self.update)
+        self._timer.start()
+
+    def get_interval(self) -> int:
+        return self._interval
+
+    @property
+    def min_interval(self) -> int:
+        """Interval while apps and the player are active, in ms. At most refresh_rate"""
+        value = int(self._settings.value("settings/captureMinInterval", 50))
+        return min(max(value, MIN_CAPTURE_INTERVAL), self.instance.refresh_rate)
+
+    @property
+    def idle_interval(self) -> int:
+        """Interval once idle for idle_timeout, in ms. At least refresh_rate"""
+        value = int(self._settings.value("settings/captureIdleInterval", 1000))
+        return max(min(value, MAX_CAPTURE_INTERVAL), self.instance.refresh_rate)
+
+    def get_last_request(self) -> float:
+        return self._last_request
+
+    def on_frame_requested(self):
+        """Record a frame request. Can be called from any thread"""
+        now = time.monotonic()
+        was_idle = now - self._last_request >= self.active_timeout
+        self._last_request = now
+
+        if was_idle:
+            # Speed up now instead of waiting for the timer
+            self._wake.emit()
+
+    def compute_interval(self) -> int:
+        now = time.monotonic()
+        since_request = now - self._last_request
+        since_activity = now - self.instance.get_last_game_activity()
+        focused = self.instance.is_focused()
+        base = self.instance.refresh_rate
+
+        if focused and since_request < self.active_timeout:
+            if since_activity < self.active_timeout:
+                return self.min_interval
+
+            return base
+
+        idle_for = since_request if focused else since_activity
+        ratio = min(1.0, idle_for / self.idle_timeout)
+        interval = base + (self.idle_interval - base) * ratio
+
+        # Avoid notifying apps of every small step
+        return int(interval - interval % 50)
+
+    @Slot()
+    def update(self):
+        interval = self.compute_interval()
+        if interval != self._interval:
+            self._interval = interval
+            self.intervalChanged.emit(interval)
+
+
+class CaptureWorker(QObject):
+    """Grab frames on a dedicated thread and publish them to the service.
+
+    While apps keep requesting frames a new one is grabbed every scheduler interval,
+    so requests are served from the latest frame without waiting. Once apps stop
+    asking the worker sleeps until the next request."""
+
+    frame_timeout = 1.0
+    """Seconds a consumer waits for a frame before giving up"""
+    max_backoff = 5.0
+    """Seconds between retries once grabs keep failing"""
+
+    _failures = 0
+    """Grabs failed in a row"""
+    _failed_at = 0.0
+    _error: Optional[BaseException] = None
+
+    def __init__(self, service: "CaptureService", **kwargs):
+        super().__init__(**kwargs)
+        self.service = service
+        self.logger = logging.getLogger(__name__ + "." + self.__class__.__name__)
+        self._cond = threading.Condition()
+        self._requested = False
+        self._running = True
+
+    def wait_frame(self, seen: Optional[Frame]) -> Optional[Frame]:
+        """Ask for a new frame and wait until one newer than seen is published.
+        Raise CaptureError if the grab fails, or if grabs are failing and the
+        worker is waiting before retrying"""
+        with self._cond:
+            if self._error is not None and self._backoff_remaining() > 0:
+                raise CaptureError("Fail to capture game") from self._error
+
+            started = time.monotonic()
+            self._requested = True
+            self._cond.notify_all()
+            self._cond.wait_for(
+                lambda: self.service._frame is not seen
+                or not self._running
+                or self._failed_at > started,
+                self.frame_timeout,
+            )
+
+            if self.service._frame is seen and self._failed_at > started:
+                raise CaptureError("Fail to capture game") from self._error
+
+        return self.service._frame
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    @Slot()
+    def run(self):
+        instance = self.service.instance
+        instance.on_capture_thread_start()
+        try:
+            while True:
+                with self._cond:
+                    while self._running:
+                        timeout = self._time_to_next_grab()
+                        if timeout == 0:
+                            break
+
+                        self._cond.wait(timeout)
+
+                    if not self._running:
+                        return
+
+                    self._requested = False
+
+                try:
+                    with metrics.time("capture.grab"):
+                        image = instance.grab_game()
+
+                    self.service.publish(image)
+                except Exception as e:
+                    self._on_grab_failed(e)
+                else:
+                    self._failures = 0
+                    self._error = None
+
+                with self._cond:
+                    self._cond.notify_all()
+        finally:
+            instance.on_capture_thread_stop()
+
+    def _time_to_next_grab(self) -> Optional[float]:
+        """Return 0 to grab now, otherwise seconds to sleep or None to sleep until
+        the next request"""
+        scheduler = self.service.scheduler
+        interval = scheduler.get_interval() / 1000
+        now = time.monotonic()
+        active = now - scheduler.get_last_request() < scheduler.active_timeout
+
+        if not active and not self._requested:
+            return None
+
+        backoff = self._backoff_remaining()
+        if backoff > 0:
+            return backoff
+
+        frame = self.service._frame
+        if frame is None:
+            return 0
+
+        remaining = frame.timestamp + interval - now
+        if remaining <= 0:
+            return 0
+        if self._requested:
+            # The consumer saw a stale frame but it was replaced since
+            self._requested = False
+
+        return remaining
+
+    def _on_grab_failed(self, error: Exception):
+        with self._cond:
+            self._failures += 1
+            self._failed_at = time.monotonic()
+            self._error = error
+
+        metrics.increment("capture.error")
+        if self._failures == 1:
+            self.logger.error("Fail to capture game", exc_info=True)
+        else:
+            self.logger.debug("Fail to capture game again: %s", error)
+
+    def _backoff_remaining(self) -> float:
+        """Seconds to wait before retrying after failed grabs, doubling the
+        scheduler interval after every failure"""
+        if self._failures == 0:
+            return 0
+
+        interval = self.service.scheduler.get_interval() / 1000
+        backoff = min(interval * 2 ** (self._failures - 1), self.max_backoff)
+        return self._failed_at + backoff - time.monotonic()
+
+
+class CaptureService(QObject):
+    """Own the frame clock of a game instance.
+
+    Frames are grabbed on a dedicated thread and published to a single slot.
+    Every app attached to the instance read the same frame for the current tick,
+    and reading a fresh frame never takes a lock."""
+
+    instance: "GameInstance"
+    scheduler: CaptureScheduler
+    _frame: Optional[Frame] = None
+
+    def __init__(self, instance: "GameInstance", **kwargs):
+        super().__init__(**kwargs)
+        self.instance = instance
+        self.scheduler = CaptureScheduler(instance, parent=self)
+
+        self.thread = QThread(self)
+        self.worker = CaptureWorker(self)
+        self.worker.moveToThread(self.thread)
+        self.thread.started.connect(self.worker.run)
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if not self.thread.isRunning() and not self.thread.isFinished():
+                self.thread.start()
+
+    def stop(self):
+        self.worker.stop()
+        self.thread.quit()
+        self.thread.wait()
+
+    def get_frame(self) -> Frame:
+        self.scheduler.on_frame_requested()
+
+        frame = self._frame
+        if frame is not None and self._is_fresh(frame):
+            metrics.cache("capture.frame", True)
+            return frame
+
+        metrics.cache("capture.frame", False)
+        self.start()
+        with metrics.time("capture.wait"):
+            frame = self.worker.wait_frame(frame)
+        if frame is None:
+            raise CaptureError("No frame captured")
+
+        return frame
+
+    def publish(self, image: "ImageType"):
+        """Replace the current frame. Called from the capture thread"""
+        if isinstance(image, np.ndarray):
+            image.flags.writeable = False
+
+        self._frame = Frame(
+            image=image,
+            version=self.instance.get_frame_version(),
+            timestamp=time.monotonic(),
+        )
+
+    def _is_fresh(self, frame: Frame) -> bool:
+        age = (time.monotonic() - frame.timestamp) * 1000
+        return age < self.scheduler.get_interval()
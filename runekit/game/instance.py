@@ -9,6 +9,8 @@ from PySide2.QtGui import QWindow
 from PySide2.QtWidgets import QGraphicsItem
 
 from runekit.image.np_utils import np_crop
+from runekit.metrics import metrics
+from .capture import CaptureService
 
 if TYPE_CHECKING:
     from .manager import GameManager
@@ -19,13 +21,17 @@ ImageType = Union[np.ndarray, Image.Image]
 
 class GameInstance(QObject):
     refresh_rate = 1000
+    frame_version = 0
+    """Incremented every time grab_game return a frame with new content"""
     manager: "GameManager"
+    capture: CaptureService
     _last_game_activity: float = 0
 
     alt1_pressed = Signal()
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.capture = CaptureService(self, parent=self)
         self.game_activity.connect(self.on_game_activity)
 
     def get_last_game_activity(self) -> float:
@@ -69,19 +75,32 @@ class GameInstance(QObject):
 
     @abc.abstractmethod
     def grab_game(self) -> ImageType:
+        """Capture the game window. Callers should go through capture instead"""
         ...
 
+    def get_frame_version(self) -> int:
+        return self.frame_version
+
+    def on_capture_thread_start(self):
+        """Called on the capture thread before the first grab_game"""
+        pass
+
+    def on_capture_thread_stop(self):
+        """Called on the capture thread after the last grab_game"""
+        pass
+
     @abc.abstractmethod
     def grab_desktop(self, x: int, y: int, w: int, h: int) -> ImageType:
         ...
 
     def grab_region(self, x: int, y: int, w: int, h: int) -> ImageType:
-        image = self.grab_game()
+        image = self.capture.get_frame().image
 
-        if isinstance(image, np.ndarray):
-            return np_crop(image, x, y, w, h)
-        else:
-            return image.crop((x, y, x + w, y + h))
+        with metrics.time("crop.grab_region"):
+            if isinstance(image, np.ndarray):
+                return np_crop(image, x, y, w, h)
+            else:
+                return image.crop((x, y, x + w, y + h))
 
     def set_taskbar_progress(self, type_: PROGRESS_TYPE, progress: float):
         pass
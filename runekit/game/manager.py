@@ -7,6 +7,9 @@ from .instance import GameInstance
 
 
 class GameManager(QObject):
+    refresh_rate = GameInstance.refresh_rate
+    """refresh_rate of the instances of this manager"""
+
     @abc.abstractmethod
     def get_instances(self) -> List[GameInstance]:
         """Return a list of active game instance. The instances returned should be stable (same instance for all invocation)"""
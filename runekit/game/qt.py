@@ -1,10 +1,10 @@
 import logging
-import time
+import threading
+from typing import Callable, Optional, TypeVar
 
 import numpy as np
-from PySide2.QtCore import QBuffer, QIODevice
-from PySide2.QtGui import QGuiApplication, QWindow, QPixmap
-import cv2
+from PySide2.QtCore import QObject, QThread, Qt, Signal, Slot
+from PySide2.QtGui import QGuiApplication, QWindow, QPixmap, QImage
 
 from runekit.image.np_utils import np_save_image
 
@@ -13,23 +13,87 @@ logger = logging.getLogger(__name__)
 
 
 def qpixmap_to_np(im: QPixmap) -> np.ndarray:
-    # from PIL.ImageQt.fromqimage
-    buffer = QBuffer()
-    buffer.open(QIODevice.ReadWrite)
-    if im.hasAlphaChannel():
-        im.save(buffer, "png")
-    else:
-        im.save(buffer, "ppm")
+    return qimage_to_np(im.toImage())
 
-    npbuf = np.frombuffer(buffer.data(), "<B")
-    buffer.close()
 
-    out = cv2.imdecode(npbuf, cv2.IMREAD_UNCHANGED)
-    if out.shape[2] == 3:
-        # Add alpha channel
-        out = np.pad(out, ((0, 0), (0, 0), (0, 1)), constant_values=0xFF)
+def qimage_to_np(image: QImage) -> np.ndarray:
+    """Copy a QImage into a BGRA array"""
+    if image.format() not in (QImage.Format_ARGB32, QImage.Format_RGB32):
+        image = image.convertToFormat(QImage.Format_ARGB32)
 
-    return out
+    # 32 bit formats are stored as 0xAARRGGBB, which is BGRA in little endian
+    width = image.width()
+    height = image.height()
+    stride = image.bytesPerLine()
+    buffer = np.frombuffer(image.constBits(), "<B", count=stride * height)
+    out = buffer.reshape(height, stride)[:, : width * 4].reshape(height, width, 4)
+
+    # Detach from the QImage memory, which is freed with the image
+    return out.copy()
+
+
+T = TypeVar("T")
+
+GUI_CALL_TIMEOUT = 1.0
+"""Seconds to wait for the GUI thread to run a call"""
+
+
+class _GuiThreadCall:
+    def __init__(self, fn: Callable[[], T]):
+        self.fn = fn
+        self.result: Optional[T] = None
+        self.error: Optional[BaseException] = None
+        self.done = threading.Event()
+
+    def run(self):
+        try:
+            self.result = self.fn()
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+
+class _GuiThreadInvoker(QObject):
+    call_signal = Signal(object)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.moveToThread(QGuiApplication.instance().thread())
+        self.call_signal.connect(self.on_call, Qt.QueuedConnection)
+
+    @Slot(object)
+    def on_call(self, call: _GuiThreadCall):
+        call.run()
+
+
+_invoker: Optional[_GuiThreadInvoker] = None
+_invoker_lock = threading.Lock()
+
+
+def run_on_gui_thread(fn: Callable[[], T], timeout=GUI_CALL_TIMEOUT) -> T:
+    """Run fn on the GUI thread and wait for its result.
+    QPixmap and QScreen may only be used from the GUI thread.
+
+    A timeout is used instead of a blocking connection, so a GUI thread waiting
+    for the caller (eg. stopping the capture thread) cannot deadlock"""
+    global _invoker
+
+    if QThread.currentThread() == QGuiApplication.instance().thread():
+        return fn()
+
+    with _invoker_lock:
+        if _invoker is None:
+            _invoker = _GuiThreadInvoker()
+
+    call = _GuiThreadCall(fn)
+    _invoker.call_signal.emit(call)
+    if not call.done.wait(timeout):
+        raise TimeoutError("GUI thread did not run the call in time")
+    if call.error is not None:
+        raise call.error
+
+    return call.result
 
 
 class QtBaseMixin:
@@ -37,31 +101,30 @@ class QtBaseMixin:
 
 
 class QtGrabMixin(QtBaseMixin):
-    refresh_rate: int
-
-    __game_last_grab = 0.0
-    __game_last_image = None
+    frame_version: int
 
     def grab_game(self) -> np.ndarray:
-        if (time.monotonic() - self.__game_last_grab) * 1000 < self.refresh_rate:
-            return self.__game_last_image
-
-        screen = QGuiApplication.primaryScreen()
-        pixmap = screen.grabWindow(self.qwindow.winId())
-        image = qpixmap_to_np(pixmap)
+        # Called from the capture thread
+        image = run_on_gui_thread(self._grab_window)
 
         if _debug_dump_file:
             logger.debug("dumping file")
             np_save_image(image, "/tmp/qtshot.bmp")
 
-        self.__game_last_image = image
-        self.__game_last_grab = time.monotonic()
-        return self.__game_last_image
+        self.frame_version += 1
+        return image
 
-    def grab_desktop(self, x, y, w, h) -> np.ndarray:
+    def _grab_window(self) -> np.ndarray:
         screen = QGuiApplication.primaryScreen()
-        pixmap = screen.grabWindow(0, x, y, w, h)
-        image = qpixmap_to_np(pixmap)
+        return qpixmap_to_np(screen.grabWindow(self.qwindow.winId()))
+
+    def grab_desktop(self, x, y, w, h) -> np.ndarray:
+        # Called from the RPC thread pool
+        def grab():
+            screen = QGuiApplication.primaryScreen()
+            return qpixmap_to_np(screen.grabWindow(0, x, y, w, h))
+
+        image = run_on_gui_thread(grab)
 
         if _debug_dump_file:
             logger.debug("dumping file")
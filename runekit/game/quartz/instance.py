@@ -1,6 +1,5 @@
 import io
 import logging
-import time
 from typing import TYPE_CHECKING
 
 import Quartz
@@ -81,9 +80,6 @@ class QuartzGameInstance(PsUtilNetStat, GameInstance):
     _is_active = False
     overlay: QGraphicsItem
 
-    __game_last_grab = 0.0
-    __game_last_image = None
-
     def __init__(self, manager: "QuartzGameManager", wid, pid, **kwargs):
         super().__init__(**kwargs)
         self.manager = manager
@@ -156,9 +152,6 @@ class QuartzGameInstance(PsUtilNetStat, GameInstance):
 
     def grab_game(self) -> Image:
         # FIXME: Crop title bar
-        if (time.monotonic() - self.__game_last_grab) * 1000 < self.refresh_rate:
-            return self.__game_last_image
-
         imgref = Quartz.CGWindowListCreateImageFromArray(
             Quartz.CGRectNull,
             [self.wid],
@@ -175,8 +168,7 @@ class QuartzGameInstance(PsUtilNetStat, GameInstance):
                 (int(out.width / scale), int(out.height / scale)), Image.NEAREST
             )
 
-        self.__game_last_grab = time.monotonic()
-        self.__game_last_image = out
+        self.frame_version += 1
         return out
 
     def grab_desktop(self, x: int, y: int, w: int, h: int) -> Image:
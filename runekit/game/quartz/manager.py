@@ -71,6 +71,9 @@ class QuartzGameManager(GameManager):
         QTimer.singleShot(1000, start)
 
     def stop(self):
+        for instance in self._instances.values():
+            instance.capture.stop()
+
         try:
             self.overlay.hide()
             self.overlay.deleteLater()
@@ -0,0 +1,50 @@
+from typing import Optional
+
+import xcffib
+import xcffib.damage
+import xcffib.shm
+import xcffib.xfixes
+
+from .shm import ShmRing, ShmSegment
+
+
+class CaptureConnection:
+    """X connection owned by the capture thread of one game instance.
+
+    Grabbing on its own connection keeps capture requests from queueing behind
+    the event worker, and keeps the shm segments private to the thread."""
+
+    ring: Optional[ShmRing] = None
+    _scratch: Optional[ShmSegment] = None
+
+    def __init__(self, ring_size: int, damage: bool):
+        self.connection = xcffib.Connection()
+        self.xshm = self.connection(xcffib.shm.key)
+        self.xdamage = self.connection(xcffib.damage.key)
+        self.xfixes = self.connection(xcffib.xfixes.key)
+
+        if damage:
+            # Extension versions are negotiated per client
+            self.xfixes.QueryVersion(2, 0).reply()
+            self.xdamage.QueryVersion(1, 1).reply()
+
+        if ring_size > 0:
+            self.ring = ShmRing(self.connection, self.xshm, ring_size)
+
+    def get_scratch(self, size: int) -> ShmSegment:
+        """Return a segment for grabs that are copied out right away"""
+        if self._scratch is None or self._scratch.size < size:
+            if self._scratch is not None:
+                self._scratch.close()
+
+            self._scratch = ShmSegment(self.connection, self.xshm, size)
+
+        return self._scratch
+
+    def close(self):
+        if self.ring:
+            self.ring.close()
+        if self._scratch:
+            self._scratch.close()
+
+        self.connection.disconnect()
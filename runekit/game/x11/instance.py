@@ -1,33 +1,60 @@
 import logging
-import time
-from typing import TYPE_CHECKING, List, Union
+import sys
+from typing import TYPE_CHECKING, List, Optional, Tuple, Union
 
+import numpy as np
 import xcffib.composite
+import xcffib.damage
 import xcffib.xproto
-from PySide2.QtCore import QRect, Signal, Slot
-from PySide2.QtGui import QWindow, QGuiApplication
+from PySide2.QtCore import QRect, QTimer, Signal, Slot
+from PySide2.QtGui import QWindow, QGuiApplication, QScreen
 from PySide2.QtWidgets import QGraphicsItem
 
 from runekit.game.instance import GameInstance
 from runekit.game.psutil_mixins import PsUtilNetStat
 from runekit.game.qt import QtGrabMixin, QtEmbedMixin
-from .ximage import zpixmap_shm_to_image
+from runekit.metrics import metrics
+from .capture import CaptureConnection
+from .shm import RING_SIZE
+from .ximage import zpixmap_shm_to_image, zpixmap_shm_to_view
 
 if TYPE_CHECKING:
     from .manager import X11GameManager
 
+DAMAGE_FULL_GRAB = 0.5
+"""Refetch the whole frame instead of the damaged rectangles when they cover this much of it"""
+SYNTHETIC_EVENT = 0x80
+CONFIG_COALESCE_INTERVAL = 16
+"""Milliseconds to collect ConfigureNotify events before applying the latest one"""
+
 
 class X11GameInstance(QtGrabMixin, QtEmbedMixin, PsUtilNetStat, GameInstance):
     wid: int
     refresh_rate = 100
+    shm_ring_size = RING_SIZE
+    """Number of persistent shm segments used for zero-copy capture. Set to 0 to always copy"""
 
     manager: "X11GameManager"
     overlay: QGraphicsItem
 
-    game_last_grab = 0.0
     game_last_image = None
     embedded_windows: List[QWindow]
-    cached_position = None
+    cached_position: Optional[QRect] = None
+    cached_scaling: Optional[float] = None
+    pixmap_size: Tuple[int, int] = (0, 0)
+    """Size of the composite pixmap, kept up to date by ConfigureNotify"""
+    capture_connection: Optional[CaptureConnection] = None
+    """Only used from the capture thread"""
+    damage_id: Optional[int] = None
+    damage_region: Optional[int] = None
+    damaged = True
+    _spare_frame: Optional[np.ndarray] = None
+    """Frame before game_last_image, recycled by damaged grabs once unreferenced"""
+    _spare_stale: List[Tuple[int, int, int, int]] = []
+    """Rectangles where the spare frame differs from game_last_image"""
+    _last_owned = False
+    """game_last_image was allocated by a damaged grab, not a shm view"""
+    _pending_config: Optional[xcffib.xproto.ConfigureNotifyEvent] = None
 
     input_signal = Signal(xcffib.Event)
     config_signal = Signal(xcffib.Event)
@@ -43,10 +70,16 @@ class X11GameInstance(QtGrabMixin, QtEmbedMixin, PsUtilNetStat, GameInstance):
         self.embedded_windows = []
         self._setup_x()
         self._setup_overlay()
+        self._setup_screens()
 
         self.input_signal.connect(self.on_input)
         self.config_signal.connect(self.on_config)
 
+        self._config_timer = QTimer(self)
+        self._config_timer.setSingleShot(True)
+        self._config_timer.setInterval(CONFIG_COALESCE_INTERVAL)
+        self._config_timer.timeout.connect(self.apply_config)
+
         self._update_is_focused()
 
     def _setup_x(self):
@@ -54,6 +87,17 @@ class X11GameInstance(QtGrabMixin, QtEmbedMixin, PsUtilNetStat, GameInstance):
             self.wid, xcffib.composite.Redirect.Automatic
         )
         self.name_pixmap()
+        self._fetch_geometry()
+        if self.manager.has_damage:
+            self.damage_id = self.manager.connection.generate_id()
+            self.manager.xdamage.Create(
+                self.damage_id,
+                self.wid,
+                xcffib.damage.ReportLevel.NonEmpty,
+                is_checked=True,
+            )
+            self.damage_region = self.manager.connection.generate_id()
+            self.manager.xfixes.CreateRegion(self.damage_region, 0, [], is_checked=True)
         self.manager.connection.core.ChangeWindowAttributesChecked(
             self.wid,
             xcffib.xproto.CW.EventMask,
@@ -66,8 +110,33 @@ class X11GameInstance(QtGrabMixin, QtEmbedMixin, PsUtilNetStat, GameInstance):
     def _setup_overlay(self):
         self.overlay, self._overlay_disconnect = self.manager.overlay.add_instance(self)
 
+    def _setup_screens(self):
+        app = QGuiApplication.instance()
+        app.screenAdded.connect(self.on_screen_added)
+        app.screenRemoved.connect(self.on_screen_change)
+        for screen in app.screens():
+            self.on_screen_added(screen)
+
+    def _fetch_geometry(self):
+        geom_req = self.manager.connection.core.GetGeometry(self.wid)
+        translated_req = self.manager.connection.core.TranslateCoordinates(
+            self.wid, self.manager.screen.root, 0, 0
+        )
+        geom = geom_req.reply()
+        translated = translated_req.reply()
+        self.manager.wake_event_worker()
+
+        border = geom.border_width
+        self.pixmap_size = (geom.width + 2 * border, geom.height + 2 * border)
+        self.cached_position = QRect(
+            translated.dst_x, translated.dst_y, geom.width, geom.height
+        )
+
     def __del__(self):
         self.manager.connection.core.FreePixmap(self.pixmap_id)
+        if self.damage_id is not None:
+            self.manager.xdamage.Destroy(self.damage_id)
+            self.manager.xfixes.DestroyRegion(self.damage_region)
         self.manager.xcomposite.UnredirectWindow(
             self.wid, xcffib.composite.Redirect.Automatic
         )
@@ -83,20 +152,15 @@ class X11GameInstance(QtGrabMixin, QtEmbedMixin, PsUtilNetStat, GameInstance):
         )
 
     def get_position(self) -> QRect:
-        if self.cached_position:
-            return self.cached_position
-
-        geom = self.manager.connection.core.GetGeometry(self.wid).reply()
-        translated = self.manager.connection.core.TranslateCoordinates(
-            self.wid, self.manager.screen.root, 0, 0
-        ).reply()
-
-        self.cached_position = QRect(
-            translated.dst_x, translated.dst_y, geom.width, geom.height
-        )
         return self.cached_position
 
     def get_scaling(self) -> float:
+        if self.cached_scaling is None:
+            self.cached_scaling = self._compute_scaling()
+
+        return self.cached_scaling
+
+    def _compute_scaling(self) -> float:
         pos = self.get_position().topLeft()
         if pos.x() < 0:
             pos.setX(0)
@@ -104,8 +168,17 @@ class X11GameInstance(QtGrabMixin, QtEmbedMixin, PsUtilNetStat, GameInstance):
             pos.setY(0)
 
         screen = QGuiApplication.screenAt(pos)
+        if screen is None:
+            screen = QGuiApplication.primaryScreen()
+
         return screen.devicePixelRatio()
 
+    def _update_scaling(self):
+        scaling = self._compute_scaling()
+        if scaling != self.cached_scaling:
+            self.cached_scaling = scaling
+            self.scalingChanged.emit(scaling)
+
     def is_focused(self) -> bool:
         return self._is_focused
 
@@ -117,39 +190,152 @@ class X11GameInstance(QtGrabMixin, QtEmbedMixin, PsUtilNetStat, GameInstance):
         # TODO: If progress = 1 set urgency flag
         pass
 
+    def on_capture_thread_start(self):
+        self.capture_connection = CaptureConnection(
+            self.shm_ring_size, self.damage_id is not None
+        )
+
+    def on_capture_thread_stop(self):
+        self.capture_connection.close()
+        self.capture_connection = None
+
     def grab_game(self):
-        if (time.monotonic() - self.game_last_grab) * 1000 < self.refresh_rate:
+        width, height = self.pixmap_size
+
+        out = None
+        if (
+            self.damage_id is not None
+            and self.game_last_image is not None
+            and self.game_last_image.shape[:2] == (height, width)
+        ):
+            out = self._grab_damaged()
+
+        if out is None:
+            out = self._grab_full(width, height)
+            self._spare_frame = None
+            self._last_owned = False
+
+        self.game_last_image = out
+
+        return out
+
+    def _grab_full(self, width: int, height: int) -> np.ndarray:
+        conn = self.capture_connection
+        if self.damage_id is not None:
+            # Everything damaged up to now is included in this grab
+            self.damaged = False
+            conn.xdamage.Subtract(self.damage_id, 0, 0)
+
+        size = width * height * 4
+        segment = conn.ring.acquire(size) if conn.ring else None
+        if segment:
+            size = self._shm_get_image(segment.xid, 0, 0, width, height).reply().size
+            out = zpixmap_shm_to_view(segment.buffer, size, width, height)
+        else:
+            # All ring segments are held by consumers, fallback to copying
+            out = self._grab_full_copy(width, height)
+
+        self.frame_version += 1
+        return out
+
+    def _grab_full_copy(self, width: int, height: int) -> np.ndarray:
+        segment = self.capture_connection.get_scratch(width * height * 4)
+        size = self._shm_get_image(segment.xid, 0, 0, width, height).reply().size
+
+        return zpixmap_shm_to_image(segment.shm, size, width, height)
+
+    def _grab_damaged(self) -> Optional[np.ndarray]:
+        """Refetch only the damaged area into the last frame.
+        Return None if a full grab should be done instead"""
+        if not self.damaged:
             return self.game_last_image
 
-        xid = shm = None
-        try:
-            geom = self.manager.connection.core.GetGeometry(self.pixmap_id).reply()
-            xid, shm = self.manager.get_shm(geom.width * geom.height * 4)
-            size = (
-                self.manager.xshm.GetImage(
-                    self.pixmap_id,
-                    0,
-                    0,
-                    geom.width,
-                    geom.height,
-                    0xFFFFFF,
-                    xcffib.xproto.ImageFormat.ZPixmap,
-                    xid,
-                    0,
-                )
-                .reply()
-                .size
+        conn = self.capture_connection
+        self.damaged = False
+        conn.xdamage.Subtract(self.damage_id, 0, self.damage_region)
+        region = conn.xfixes.FetchRegion(self.damage_region).reply()
+
+        height, width = self.game_last_image.shape[:2]
+        rects = []
+        for rect in region.rectangles:
+            x1 = max(0, rect.x)
+            y1 = max(0, rect.y)
+            x2 = min(width, rect.x + rect.width)
+            y2 = min(height, rect.y + rect.height)
+            if x2 > x1 and y2 > y1:
+                rects.append((x1, y1, x2 - x1, y2 - y1))
+
+        area = sum(w * h for _, _, w, h in rects)
+        if area == 0:
+            return self.game_last_image
+        if area > width * height * DAMAGE_FULL_GRAB:
+            return None
+
+        frame = self._take_spare_frame()
+        segment = conn.get_scratch(area * 4)
+
+        # Send all requests before waiting for any reply
+        requests = []
+        offset = 0
+        for x, y, w, h in rects:
+            cookie = self._shm_get_image(segment.xid, x, y, w, h, offset)
+            requests.append((cookie, x, y, w, h, offset))
+            offset += w * h * 4
+
+        for cookie, x, y, w, h, offset in requests:
+            size = cookie.reply().size
+            frame[y : y + h, x : x + w] = zpixmap_shm_to_image(
+                segment.shm, size, w, h, offset
             )
 
-            out = zpixmap_shm_to_image(shm, size, geom.width, geom.height)
+        frame.flags.writeable = False
 
-            self.game_last_image = out
-            self.game_last_grab = time.monotonic()
+        # The previous frame is recycled on a later grab, once nobody reads it
+        if self._last_owned:
+            self._spare_frame = self.game_last_image
+            self._spare_stale = rects
+        self._last_owned = True
 
-            return out
-        finally:
-            if shm:
-                self.manager.free_shm((xid, shm))
+        self.frame_version += 1
+        return frame
+
+    def _take_spare_frame(self) -> np.ndarray:
+        """Return a writable copy of game_last_image.
+
+        Published frames are read without locking, so they are never patched in
+        place. Instead the frame before it is brought up to date by copying the
+        rectangles damaged since, and only if no consumer still holds it
+        (including views of it). Otherwise the whole frame is copied."""
+        last = self.game_last_image
+        spare = self._spare_frame
+        self._spare_frame = None
+
+        # References: the local variable and getrefcount's argument
+        if spare is None or spare.shape != last.shape or sys.getrefcount(spare) > 2:
+            metrics.cache("capture.spare_frame", False)
+            return last.copy()
+
+        metrics.cache("capture.spare_frame", True)
+        spare.flags.writeable = True
+        for x, y, w, h in self._spare_stale:
+            spare[y : y + h, x : x + w] = last[y : y + h, x : x + w]
+
+        return spare
+
+    def _shm_get_image(
+        self, xid: int, x: int, y: int, width: int, height: int, offset=0
+    ):
+        return self.capture_connection.xshm.GetImage(
+            self.pixmap_id,
+            x,
+            y,
+            width,
+            height,
+            0xFFFFFF,
+            xcffib.xproto.ImageFormat.ZPixmap,
+            xid,
+            offset,
+        )
 
     def embed_window(self, window: QWindow):
         super().embed_window(window)
@@ -160,15 +346,49 @@ class X11GameInstance(QtGrabMixin, QtEmbedMixin, PsUtilNetStat, GameInstance):
 
     @Slot(xcffib.Event)
     def on_config(self, evt: xcffib.xproto.ConfigureNotifyEvent):
+        # Dragging or resizing send a storm of events, only apply the latest one
+        # once per interval
+        self._pending_config = evt
+        if not self._config_timer.isActive():
+            self._config_timer.start()
+
+    @Slot()
+    def apply_config(self):
+        evt = self._pending_config
+        if evt is None:
+            return
+
+        self._pending_config = None
         self.name_pixmap()
 
-        translated = self.manager.connection.core.TranslateCoordinates(
-            self.wid, self.manager.screen.root, 0, 0
-        ).reply()
-        size = QRect(translated.dst_x, translated.dst_y, evt.width, evt.height)
+        border = evt.border_width
+        self.pixmap_size = (evt.width + 2 * border, evt.height + 2 * border)
 
-        self.cached_position = size
-        self.positionChanged.emit(size)
+        if (evt.response_type or 0) & SYNTHETIC_EVENT:
+            # Window managers send synthetic events in root coordinates (ICCCM 4.1.5)
+            position = QRect(evt.x + border, evt.y + border, evt.width, evt.height)
+        else:
+            # Real events are relative to the parent, which is usually the WM frame
+            translated = self.manager.connection.core.TranslateCoordinates(
+                self.wid, self.manager.screen.root, 0, 0
+            ).reply()
+            self.manager.wake_event_worker()
+            position = QRect(translated.dst_x, translated.dst_y, evt.width, evt.height)
+
+        if position != self.cached_position:
+            self.cached_position = position
+            self.positionChanged.emit(position)
+            self._update_scaling()
+
+    @Slot(QScreen)
+    def on_screen_added(self, screen: QScreen):
+        screen.geometryChanged.connect(self.on_screen_change)
+        screen.logicalDotsPerInchChanged.connect(self.on_screen_change)
+        self.on_screen_change()
+
+    @Slot()
+    def on_screen_change(self):
+        self._update_scaling()
 
     @Slot(xcffib.Event)
     def on_input(
@@ -1,12 +1,15 @@
 import logging
 import os
+import select
 import struct
-from typing import List, Dict, Tuple, Union
+import threading
+from typing import List, Dict, Optional, Union
 
-import sysv_ipc
 import xcffib
 import xcffib.composite
+import xcffib.damage
 import xcffib.shm
+import xcffib.xfixes
 import xcffib.xinput
 import xcffib.xproto
 from PySide2.QtCore import QThread, Slot, QObject, Signal
@@ -15,23 +18,27 @@ from runekit.game import GameManager
 from .instance import GameInstance, X11GameInstance
 from ..overlay import DesktopWideOverlay
 
-MAX_SHM = 10
+EVENT_POLL_TIMEOUT = 0.1
+"""Seconds to wait on the X socket before checking for events queued by other threads,
+in case a reply was read without waking the event worker"""
 NET_ACTIVE_WINDOW = "_NET_ACTIVE_WINDOW"
+NET_CLIENT_LIST = "_NET_CLIENT_LIST"
 WM_APP_NAME = os.getenv("RK_WM_APP_NAME", "RuneScape")
 
 
 class X11GameManager(GameManager):
     connection: xcffib.Connection
+    has_damage = False
+    refresh_rate = X11GameInstance.refresh_rate
+    event_worker: Optional["X11EventWorker"] = None
 
     _instances: Dict[int, X11GameInstance]
     _atom: Dict[bytes, int]
-    _shm: List[Tuple[int, sysv_ipc.SharedMemory]]
 
     def __init__(self, **kwargs):
         super().__init__(*kwargs)
         self._instances = {}
         self._atom = {}
-        self._shm = []
 
         self.logger = logging.getLogger(__name__ + "." + self.__class__.__name__)
         self.connection = xcffib.Connection()
@@ -39,7 +46,10 @@ class X11GameManager(GameManager):
         self.xcomposite = self.connection(xcffib.composite.key)
         self.xshm = self.connection(xcffib.shm.key)
         self.xinput = self.connection(xcffib.xinput.key)
+        self.xdamage = self.connection(xcffib.damage.key)
+        self.xfixes = self.connection(xcffib.xfixes.key)
         self._setup_composite()
+        self._setup_damage()
         self._setup_overlay()
 
         self.event_thread = QThread(self)
@@ -56,28 +66,81 @@ class X11GameManager(GameManager):
         self.get_instances()
 
     def stop(self):
+        for instance in self._instances.values():
+            instance.capture.stop()
+
         self.event_thread.requestInterruption()
+        self.event_worker.interrupt()
         self.event_thread.quit()
         self.event_thread.wait()
+        self.event_worker.close()
+
+    def wake_event_worker(self):
+        """Make the event worker poll again. Call after reading replies on the
+        shared connection outside of the event worker: events received meanwhile
+        are queued by xcb without the socket becoming readable again"""
+        if self.event_worker is not None:
+            self.event_worker.interrupt()
 
     def get_instances(self) -> List[GameInstance]:
-        def visit(wid: int):
-            if self.is_game(wid):
-                if wid not in self._instances:
-                    self.logger.info("Found game instance %d", wid)
-                    instance = X11GameInstance(self, wid, parent=self)
-                    self._instances[wid] = instance
+        for wid in self.find_game_windows():
+            if wid not in self._instances:
+                self.logger.info("Found game instance %d", wid)
+                instance = X11GameInstance(self, wid, parent=self)
+                self._instances[wid] = instance
 
-            try:
-                query = self.connection.core.QueryTree(wid).reply()
-                for child in query.children:
-                    visit(child)
-            except xcffib.xproto.WindowError:
-                return
+        self.wake_event_worker()
+        return list(self._instances.values())
 
-        visit(self.screen.root)
+    def find_game_windows(self) -> List[int]:
+        """Find game windows using the window manager's client list if available,
+        otherwise by walking the whole window tree"""
+        clients = self.get_client_list()
+        if clients is not None:
+            return self._filter_games(clients)
 
-        return list(self._instances.values())
+        return self._walk_tree()
+
+    def get_client_list(self) -> Optional[List[int]]:
+        reply = self._request_property(
+            self.screen.root, NET_CLIENT_LIST, xcffib.xproto.Atom.WINDOW, 0, 2**16
+        ).reply()
+        if reply.type != xcffib.xproto.Atom.WINDOW:
+            return None
+
+        return list(struct.unpack("=%dI" % reply.value_len, reply.value.buf()))
+
+    def _filter_games(self, wids: List[int]) -> List[int]:
+        # Send every request before waiting on any reply
+        requests = [(wid, self._request_game_check(wid)) for wid in wids]
+        return [wid for wid, cookies in requests if self._is_game_reply(*cookies)]
+
+    def _walk_tree(self) -> List[int]:
+        """Breadth first tree walk that pipelines all requests of each level"""
+        out = []
+        level = [self.screen.root]
+
+        while level:
+            requests = [
+                (
+                    wid,
+                    self.connection.core.QueryTree(wid),
+                    self._request_game_check(wid),
+                )
+                for wid in level
+            ]
+            level = []
+
+            for wid, tree_req, game_req in requests:
+                if self._is_game_reply(*game_req):
+                    out.append(wid)
+
+                try:
+                    level.extend(tree_req.reply().children)
+                except xcffib.xproto.WindowError:
+                    continue
+
+        return out
 
     def get_active_instance(self) -> Union[GameInstance, None]:
         for instance in self._instances.values():
@@ -87,14 +150,28 @@ class X11GameManager(GameManager):
         return None
 
     def is_game(self, wid: int) -> bool:
-        geom_req = self.connection.core.GetGeometry(wid)
+        out = self._is_game_reply(*self._request_game_check(wid))
+        self.wake_event_worker()
+        return out
+
+    def _request_game_check(self, wid: int):
+        return (
+            self.connection.core.GetGeometry(wid),
+            self._request_property(wid, xcffib.xproto.Atom.WM_CLASS),
+        )
+
+    def _is_game_reply(self, geom_req, wm_class_req) -> bool:
         try:
-            wm_class = self.get_property(wid, xcffib.xproto.Atom.WM_CLASS)
+            wm_class = self._decode_property(wm_class_req.reply())
         except xcffib.xproto.WindowError:
             geom_req.discard_reply()
             return False
 
-        geom = geom_req.reply()
+        try:
+            geom = geom_req.reply()
+        except (xcffib.xproto.WindowError, xcffib.xproto.DrawableError):
+            return False
+
         if geom.width == 32 and geom.height == 32:
             # OpenGL test window
             return False
@@ -116,6 +193,19 @@ class X11GameManager(GameManager):
     def _setup_composite(self):
         self.xcomposite.QueryVersion(0, 4, is_checked=True)
 
+    def _setup_damage(self):
+        for name in (b"XFIXES", b"DAMAGE"):
+            if not self.connection.core.QueryExtension(len(name), name).reply().present:
+                self.logger.warning(
+                    "%s extension is not available, damage tracking is disabled",
+                    name.decode("ascii"),
+                )
+                return
+
+        self.xfixes.QueryVersion(2, 0).reply()
+        self.xdamage.QueryVersion(1, 1).reply()
+        self.has_damage = True
+
     def get_property(
         self,
         wid: int,
@@ -124,15 +214,29 @@ class X11GameManager(GameManager):
         index=0,
         max_values=1000,
     ):
-        reply = self.connection.core.GetProperty(
+        reply = self._request_property(wid, name, type_, index, max_values).reply()
+        self.wake_event_worker()
+        return self._decode_property(reply)
+
+    def _request_property(
+        self,
+        wid: int,
+        name: str,
+        type_=xcffib.xproto.GetPropertyType.Any,
+        index=0,
+        max_values=1000,
+    ) -> xcffib.xproto.GetPropertyCookie:
+        return self.connection.core.GetProperty(
             False,
             wid,
             self.get_atom(name),
             type_,
             index,
             max_values,
-        ).reply()
+        )
 
+    @staticmethod
+    def _decode_property(reply: xcffib.xproto.GetPropertyReply):
         if reply.type == xcffib.xproto.Atom.STRING:
             return reply.value.to_string()[:-1]
         elif reply.type in (xcffib.xproto.Atom.WINDOW, xcffib.xproto.Atom.CARDINAL):
@@ -153,32 +257,11 @@ class X11GameManager(GameManager):
             return self._atom[atom]
 
         out = self.connection.core.InternAtom(False, len(atom), atom).reply().atom
+        self.wake_event_worker()
         self._atom[atom] = out
 
         return out
 
-    def get_shm(self, size: int) -> Tuple[int, sysv_ipc.SharedMemory]:
-        for item in self._shm:
-            if item[1].size >= size:
-                self._shm.remove(item)
-                return item
-
-        shm = sysv_ipc.SharedMemory(None, flags=sysv_ipc.IPC_CREX, size=size)
-        xid = self.connection.generate_id()
-        self.xshm.Attach(xid, shm.id, False, is_checked=True)
-        return xid, shm
-
-    def free_shm(self, shm: Tuple[int, sysv_ipc.SharedMemory]):
-        self._shm.append(shm)
-        self.gc_shm()
-
-    def gc_shm(self):
-        while len(self._shm) > MAX_SHM:
-            xid, shm = self._shm.pop(0)
-            self.xshm.Detach(xid)
-            shm.detach()
-            shm.remove()
-
     @Slot(xcffib.Event)
     def on_game_opened(self, evt: xcffib.xproto.CreateNotifyEvent):
         self.logger.info("New game window opened %d", evt.window)
@@ -192,6 +275,7 @@ class X11GameManager(GameManager):
         self.logger.info("Game window %d closed", wid)
         instance = self._instances[wid]
         del self._instances[wid]
+        instance.capture.stop()
         self.instance_removed.emit(instance)
         self.instance_changed.emit()
 
@@ -212,8 +296,36 @@ class X11EventWorker(QObject):
             xcffib.xproto.ButtonPressEvent: self.on_input_event,
             xcffib.xproto.CreateNotifyEvent: self.on_create,
             xcffib.xproto.DestroyNotifyEvent: self.on_destroy,
+            xcffib.damage.NotifyEvent: self.on_damage,
         }
+        self.root = self.manager.screen.root
+        self.net_active_window = self.manager.get_atom(NET_ACTIVE_WINDOW)
         self.active_win_id = self.manager.get_active_window()
+        self._active_window_changed = False
+        self._interrupt_read, self._interrupt_write = os.pipe()
+        # A full pipe already wakes the loop, wakers must never block on it
+        os.set_blocking(self._interrupt_write, False)
+        self._interrupt_lock = threading.Lock()
+        self._closed = False
+
+    def interrupt(self):
+        """Wake up the event loop. Can be called from any thread"""
+        with self._interrupt_lock:
+            if not self._closed:
+                try:
+                    os.write(self._interrupt_write, b"\0")
+                except BlockingIOError:
+                    pass
+
+    def close(self):
+        """Release the wake up pipe. Call once run() has returned"""
+        with self._interrupt_lock:
+            if self._closed:
+                return
+
+            self._closed = True
+            os.close(self._interrupt_read)
+            os.close(self._interrupt_write)
 
     @Slot()
     def run(self):
@@ -226,44 +338,65 @@ class X11EventWorker(QObject):
             ],
         ).check()
         current_thread = QThread.currentThread()
+        connection = self.manager.connection
+        wait_fds = [connection.get_file_descriptor(), self._interrupt_read]
 
-        while True:
-            if current_thread.isInterruptionRequested():
-                return
+        while not current_thread.isInterruptionRequested():
+            self.dispatch_pending()
+
+            # Threads reading replies wake us up through wake_event_worker(),
+            # the timeout is only a fallback
+            readable, _, _ = select.select(wait_fds, [], [], EVENT_POLL_TIMEOUT)
+            if self._interrupt_read in readable:
+                os.read(self._interrupt_read, 4096)
 
+    def dispatch_pending(self):
+        """Dispatch every event currently available"""
+        handlers = self.handlers
+        while True:
             evt = self.manager.connection.poll_for_event()
             if evt is None:
-                QThread.msleep(10)
+                break
+
+            handler = handlers.get(type(evt))
+            if handler is None:
                 continue
 
-            for wanted_type, handler in self.handlers.items():
-                if isinstance(evt, wanted_type):
-                    try:
-                        handler(evt)
-                    except:
-                        self.logger.error(
-                            "Error handling event %s", repr(evt), exc_info=True
-                        )
+            try:
+                handler(evt)
+            except:
+                self.logger.error("Error handling event %s", repr(evt), exc_info=True)
+
+        if self._active_window_changed:
+            self._active_window_changed = False
+            try:
+                self.update_active_window()
+            except:
+                self.logger.error("Error reading active window", exc_info=True)
 
     def on_property_change(self, evt: xcffib.xproto.PropertyNotifyEvent):
         if (
-            evt.state == xcffib.xproto.Property.NewValue
-            and evt.atom == self.manager.get_atom(NET_ACTIVE_WINDOW)
-            and evt.window == self.manager.screen.root
+            evt.atom == self.net_active_window
+            and evt.window == self.root
+            and evt.state == xcffib.xproto.Property.NewValue
         ):
-            active_win_id = self.manager.get_active_window()
+            # Read the property once after the whole batch is dispatched
+            self._active_window_changed = True
 
-            if self.active_win_id == active_win_id:
-                return
+    def update_active_window(self):
+        active_win_id = self.manager.get_property(self.root, self.net_active_window)
 
-            self.active_win_id = active_win_id
+        if self.active_win_id == active_win_id:
+            return
+
+        self.active_win_id = active_win_id
 
-            for id_, instance in self.manager._instances.items():
-                active = active_win_id == id_
+        for id_, instance in self.manager._instances.items():
+            active = active_win_id == id_
 
-                if active != instance._is_focused:
-                    instance._is_focused = active
-                    instance.focusChanged.emit(active)
+            if active != instance._is_focused:
+                instance._is_focused = active
+                instance.focusChanged.emit(active)
 
     def on_input_event(
         self, evt: Union[xcffib.xproto.KeyPressEvent, xcffib.xproto.ButtonPressEvent]
@@ -279,6 +412,12 @@ class X11EventWorker(QObject):
         except KeyError:
             pass
 
+    def on_damage(self, evt: xcffib.damage.NotifyEvent):
+        try:
+            self.manager._instances[evt.drawable].damaged = True
+        except KeyError:
+            pass
+
     def on_create(self, evt: xcffib.xproto.CreateNotifyEvent):
         if evt.window in self.manager._instances:
             return
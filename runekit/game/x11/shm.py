@@ -0,0 +1,87 @@
+import sys
+from typing import List, Optional
+
+import numpy as np
+import sysv_ipc
+import xcffib
+
+from runekit.metrics import metrics
+
+RING_SIZE = 3
+
+
+class ShmSegment:
+    """A MIT-SHM segment that stays attached to the X server until closed.
+
+    Frames are handed out as NumPy views over the segment memory. All views share
+    `buffer` as their base, so the segment is busy as long as any of them is alive."""
+
+    xid: int
+    shm: sysv_ipc.SharedMemory
+    buffer: np.ndarray
+
+    def __init__(self, connection: xcffib.Connection, xshm, size: int):
+        self.xshm = xshm
+        self.shm = sysv_ipc.SharedMemory(None, flags=sysv_ipc.IPC_CREX, size=size)
+        self.xid = connection.generate_id()
+        self.xshm.Attach(self.xid, self.shm.id, False, is_checked=True)
+        self.buffer = np.frombuffer(memoryview(self.shm), "<B")
+        metrics.increment("capture.shm_attach")
+
+    @property
+    def size(self) -> int:
+        return self.shm.size
+
+    def in_use(self) -> bool:
+        # One reference from self, one from getrefcount's argument
+        return sys.getrefcount(self.buffer) > 2
+
+    def close(self):
+        self.xshm.Detach(self.xid)
+        del self.buffer
+        self.shm.detach()
+        self.shm.remove()
+
+
+class ShmRing:
+    """Small ring of persistent shm segments used for zero-copy capture"""
+
+    segments: List[ShmSegment]
+
+    def __init__(self, connection: xcffib.Connection, xshm, size=RING_SIZE):
+        self.connection = connection
+        self.xshm = xshm
+        self.max_segments = size
+        self.segments = []
+        self._next = 0
+
+    def acquire(self, size: int) -> Optional[ShmSegment]:
+        """Return a segment of at least size bytes that no consumer is viewing,
+        or None if every segment is still in use"""
+        count = len(self.segments)
+        for i in range(count):
+            idx = (self._next + i) % count
+            segment = self.segments[idx]
+            if segment.in_use():
+                continue
+
+            if segment.size < size:
+                segment.close()
+                segment = ShmSegment(self.connection, self.xshm, size)
+                self.segments[idx] = segment
+
+            self._next = (idx + 1) % count
+            return segment
+
+        if count < self.max_segments:
+            segment = ShmSegment(self.connection, self.xshm, size)
+            self.segments.append(segment)
+            return segment
+
+        return None
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+        self.segments = []
@@ -4,10 +4,22 @@ from PIL import ImageOps, Image
 
 
 def zpixmap_shm_to_image(
-    shm: sysv_ipc.SharedMemory, size: int, width: int, height: int
+    shm: sysv_ipc.SharedMemory, size: int, width: int, height: int, offset=0
 ) -> np.ndarray:
-    out = np.frombuffer(shm.read(size), "<B").copy()
+    out = np.frombuffer(shm.read(size, offset), "<B").copy()
     out.shape = (height, width, 4)
     out[:, :, 3] = 0xFF  # Convert BGRX to BGRA
 
     return out
+
+
+def zpixmap_shm_to_view(
+    buffer: np.ndarray, size: int, width: int, height: int
+) -> np.ndarray:
+    """Like zpixmap_shm_to_image, but return a read only view over the shm buffer"""
+    out = buffer[:size]
+    out.shape = (height, width, 4)
+    out[:, :, 3] = 0xFF  # Convert BGRX to BGRA
+    out.flags.writeable = False
+
+    return out
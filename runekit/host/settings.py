@@ -21,9 +21,14 @@ from PySide2.QtWidgets import (
     QAbstractItemView,
     QInputDialog,
     QMessageBox,
+    QFileDialog,
+    QTableWidgetItem,
+    QHeaderView,
 )
 
 from .appstore_model import AppStoreModel
+from ..game.capture import MAX_CAPTURE_INTERVAL, MIN_CAPTURE_INTERVAL
+from ..metrics import metrics
 from ..ui import TooltipNotifier, TrayIconNotifier, AutoNotifier
 
 if TYPE_CHECKING:
@@ -41,6 +46,7 @@ class SettingsDialog(QMainWindow):
         tab = QTabWidget(self)
         tab.addTab(ApplicationPage(self.host, parent=self), "Applications")
         tab.addTab(InterfacePage(self.host, parent=self), "Interface")
+        tab.addTab(PerformancePage(parent=self), "Performance")
 
         self.setCentralWidget(tab)
         self.setContentsMargins(11, 11, 11, 11)
@@ -193,6 +199,28 @@ class InterfacePage(QWidget):
         border_field.stateChanged.connect(self.on_change_styled_border)
         layout.addRow(None, border_field)
 
+        # Takes effect without restarting. Ranges are the values the capture
+        # scheduler applies, the refresh rate bounds both intervals
+        refresh_rate = self.host.manager.refresh_rate
+        capture_min_label = QLabel("Fastest capture interval (ms)", self)
+        capture_min_field = QSpinBox(self)
+        capture_min_field.setRange(MIN_CAPTURE_INTERVAL, refresh_rate)
+        capture_min_field.setValue(
+            int(self.settings.value("settings/captureMinInterval", 50))
+        )
+        capture_min_field.valueChanged.connect(self.on_change_capture_min_interval)
+        layout.addRow(capture_min_label, capture_min_field)
+
+        capture_idle_label = QLabel("Idle capture interval (ms)", self)
+        capture_idle_field = QSpinBox(self)
+        capture_idle_field.setRange(refresh_rate, MAX_CAPTURE_INTERVAL)
+        capture_idle_field.setSingleStep(100)
+        capture_idle_field.setValue(
+            int(self.settings.value("settings/captureIdleInterval", 1000))
+        )
+        capture_idle_field.valueChanged.connect(self.on_change_capture_idle_interval)
+        layout.addRow(capture_idle_label, capture_idle_field)
+
     @Slot(int)
     def preview_tooltip(self, index: int):
         type_ = list(AutoNotifier.availableMethods().items())[index][0]
@@ -219,3 +247,108 @@ class InterfacePage(QWidget):
     def on_change_styled_border(self, state: int):
         checked = state == Qt.Checked
         self.settings.setValue("settings/styledBorder", checked)
+
+    @Slot(int)
+    def on_change_capture_min_interval(self, value: int):
+        self.settings.setValue("settings/captureMinInterval", value)
+
+    @Slot(int)
+    def on_change_capture_idle_interval(self, value: int):
+        self.settings.setValue("settings/captureIdleInterval", value)
+
+
+class PerformancePage(QWidget):
+    columns = ["Metric", "Count", "Mean (ms)", "p50 (ms)", "p95 (ms)", "Max (ms)"]
+    refresh_interval = 1000
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._layout()
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(self.refresh_interval)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start()
+        self.refresh()
+
+    def _layout(self):
+        layout = QVBoxLayout(self)
+        self.setLayout(layout)
+
+        self.table = QTableWidget(0, len(self.columns), self)
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.verticalHeader().hide()
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.table, 1)
+
+        self.summary = QLabel(self)
+        self.summary.setWordWrap(True)
+        layout.addWidget(self.summary)
+
+        buttons = QHBoxLayout()
+        buttons.setAlignment(Qt.AlignRight)
+
+        reset_button = QPushButton("Reset", self)
+        reset_button.clicked.connect(self.on_reset)
+        buttons.addWidget(reset_button)
+
+        dump_button = QPushButton("Save to file...", self)
+        dump_button.clicked.connect(self.on_dump)
+        buttons.addWidget(dump_button)
+
+        layout.addLayout(buttons)
+
+    @Slot()
+    def refresh(self):
+        if not self.isVisible():
+            return
+
+        snapshot = metrics.snapshot()
+        latency = snapshot["latency"]
+
+        self.table.setRowCount(len(latency))
+        for row, (name, stats) in enumerate(latency.items()):
+            values = [
+                name,
+                str(stats["count"]),
+                "%.2f" % stats["mean"],
+                "%.2f" % stats["p50"],
+                "%.2f" % stats["p95"],
+                "%.2f" % stats["max"],
+            ]
+            for column, value in enumerate(values):
+                self.table.setItem(row, column, QTableWidgetItem(value))
+
+        lines = [
+            "%s: %d" % (name, value) for name, value in snapshot["counters"].items()
+        ]
+        lines += [
+            "%s hit rate: %.1f%% (%d/%d)"
+            % (
+                name,
+                stats["rate"] * 100,
+                stats["hits"],
+                stats["hits"] + stats["misses"],
+            )
+            for name, stats in snapshot["caches"].items()
+        ]
+        self.summary.setText("\n".join(lines))
+
+    @Slot()
+    def on_reset(self):
+        metrics.reset()
+        self.refresh()
+
+    @Slot()
+    def on_dump(self):
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Save metrics", "runekit-metrics.json", "JSON (*.json)"
+        )
+        if not path:
+            return
+
+        try:
+            metrics.dump(path)
+        except OSError as e:
+            QMessageBox.critical(self, "Cannot save metrics", str(e))
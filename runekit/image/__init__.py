@@ -1 +1,10 @@
-from .algo import is_color_percent_gte
+from .algo import (
+    is_color_percent_gte,
+    find_subimage,
+    color_masks,
+    color_stats,
+    dominant_colors,
+    diff_bbox,
+    ColorStats,
+)
+from .ocr import OCRFont, decode_rgb
@@ -1,7 +1,19 @@
-from typing import List
+from typing import List, NamedTuple, Optional, Tuple
 
+import cv2
 import numpy as np
 
+RGB = Tuple[int, int, int]
+
+
+class ColorStats(NamedTuple):
+    total: int
+    counts: List[int]
+    """Pixels matching each color"""
+    rows: List[List[int]]
+    """Per color, matching pixels in each row. Empty unless projections are asked"""
+    columns: List[List[int]]
+
 
 def is_color_percent_gte(image: np.ndarray, color: List, percent: float) -> bool:
     """Check that the image has at least percent% of the given color"""
@@ -9,3 +21,107 @@ def is_color_percent_gte(image: np.ndarray, color: List, percent: float) -> bool
     total_pixels = image.shape[0] * image.shape[1]
     color_percent = black_pixels / total_pixels
     return color_percent >= percent
+
+
+def find_subimage(haystack: np.ndarray, needle: np.ndarray) -> List[Tuple[int, int]]:
+    """Find all exact occurrences of needle in haystack. Return the (x, y) of their top left corners.
+    Needle pixels with zero alpha match anything, the alpha channel itself is not compared"""
+    needle_height, needle_width = needle.shape[:2]
+    height, width = haystack.shape[:2]
+    if needle_height > height or needle_width > width:
+        return []
+
+    # Compare BGR as a single uint32 per pixel
+    haystack = np.ascontiguousarray(haystack).view("<u4")[:, :, 0]
+    needle_pixels = np.ascontiguousarray(needle).view("<u4")[:, :, 0]
+
+    opaque = np.argwhere(needle[:, :, 3] != 0)
+    if len(opaque) == 0:
+        return []
+    values = needle_pixels[opaque[:, 0], opaque[:, 1]] & 0xFFFFFF
+
+    # Find candidates from the first opaque pixel in one pass,
+    # then narrow them down pixel by pixel until none or only matches are left
+    py, px = opaque[0]
+    candidates = (
+        haystack[
+            py : height - needle_height + 1 + py, px : width - needle_width + 1 + px
+        ]
+        & 0xFFFFFF
+    ) == values[0]
+    ys, xs = np.nonzero(candidates)
+
+    for (py, px), value in zip(opaque[1:], values[1:]):
+        if len(ys) == 0:
+            break
+
+        keep = (haystack[ys + py, xs + px] & 0xFFFFFF) == value
+        ys = ys[keep]
+        xs = xs[keep]
+
+    return list(zip(xs.tolist(), ys.tolist()))
+
+
+def color_masks(image: np.ndarray, colors: List[RGB], tolerance=0) -> np.ndarray:
+    """Return a (color, y, x) mask of the pixels whose B, G and R are all within
+    tolerance of each color. Alpha is ignored"""
+    height, width, channels = image.shape
+    out = np.empty((len(colors), height, width), dtype=np.uint8)
+
+    for mask, (r, g, b) in zip(out, colors):
+        lower = [max(0, b - tolerance), max(0, g - tolerance), max(0, r - tolerance)]
+        upper = [
+            min(255, b + tolerance),
+            min(255, g + tolerance),
+            min(255, r + tolerance),
+        ]
+        lower += [0] * (channels - 3)
+        upper += [255] * (channels - 3)
+        cv2.inRange(image, np.array(lower), np.array(upper), dst=mask)
+
+    return out
+
+
+def color_stats(
+    image: np.ndarray, colors: List[RGB], tolerance=0, projections=False
+) -> ColorStats:
+    """Count pixels near each color, optionally per row and per column"""
+    masks = color_masks(image, colors, tolerance)
+
+    return ColorStats(
+        total=image.shape[0] * image.shape[1],
+        counts=np.count_nonzero(masks, axis=(1, 2)).tolist(),
+        rows=np.count_nonzero(masks, axis=2).tolist() if projections else [],
+        columns=np.count_nonzero(masks, axis=1).tolist() if projections else [],
+    )
+
+
+def dominant_colors(image: np.ndarray, count: int) -> List[Tuple[int, int]]:
+    """Return up to count of the most common colors as (0xRRGGBB, pixels)"""
+    # BGRA little endian reads as 0xAARRGGBB
+    pixels = np.ascontiguousarray(image).view("<u4")[:, :, 0] & 0xFFFFFF
+    values, counts = np.unique(pixels, return_counts=True)
+
+    top = np.argsort(counts, kind="stable")[::-1][:count]
+    return list(zip(values[top].tolist(), counts[top].tolist()))
+
+
+def diff_bbox(a: np.ndarray, b: np.ndarray) -> Optional[Tuple[int, int, int, int]]:
+    """Return the (x, y, width, height) bounding box of the pixels whose BGR
+    differ between two images of the same shape, or None if they are equal"""
+    # Compare BGR as a single uint32 per pixel
+    a = np.ascontiguousarray(a).view("<u4")[:, :, 0]
+    b = np.ascontiguousarray(b).view("<u4")[:, :, 0]
+    changed = ((a ^ b) & 0xFFFFFF) != 0
+
+    rows = np.flatnonzero(changed.any(axis=1))
+    if len(rows) == 0:
+        return None
+
+    columns = np.flatnonzero(changed.any(axis=0))
+    return (
+        int(columns[0]),
+        int(rows[0]),
+        int(columns[-1] - columns[0] + 1),
+        int(rows[-1] - rows[0] + 1),
+    )
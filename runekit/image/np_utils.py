@@ -6,30 +6,66 @@ if TYPE_CHECKING:
     from runekit.game.instance import ImageType
 
 
+class CropRegion:
+    """Rectangle of an image that may extend past its edges, read as zeros there.
+
+    Only the clip rectangle is kept as a view of the image. Padding is written
+    together with the pixels by write_into(), so nothing is allocated until the
+    region is serialized."""
+
+    def __init__(self, image: np.ndarray, x: int, y: int, w: int, h: int):
+        img_height, img_width = image.shape[:2]
+        if w is None:
+            w = img_width
+        if h is None:
+            h = img_height
+
+        x1 = min(max(0, x), img_width)
+        y1 = min(max(0, y), img_height)
+        x2 = max(min(x + w, img_width), x1)
+        y2 = max(min(y + h, img_height), y1)
+
+        self.source = image[y1:y2, x1:x2]
+        self.left = min(max(0, -x), w)
+        self.top = min(max(0, -y), h)
+        self.shape = (h, w, *image.shape[2:])
+        self.dtype = image.dtype
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    @property
+    def padded(self) -> bool:
+        return self.source.shape != self.shape
+
+    def write_into(self, out: np.ndarray, copy=np.copyto):
+        """Write the region into out, which has the region shape.
+        copy(dst, src) moves the visible pixels and may convert them on the way"""
+        top, left = self.top, self.left
+        height, width = self.source.shape[:2]
+
+        if self.padded:
+            out[:top] = 0
+            out[top + height :] = 0
+            out[top : top + height, :left] = 0
+            out[top : top + height, left + width :] = 0
+
+        if height and width:
+            copy(out[top : top + height, left : left + width], self.source)
+
+    def to_array(self) -> np.ndarray:
+        """Return the region as an array. A view of the image if it is not padded"""
+        if not self.padded:
+            return self.source
+
+        out = np.empty(self.shape, dtype=self.dtype)
+        self.write_into(out)
+        return out
+
+
 def np_crop(image: np.ndarray, x: int, y: int, w: int, h: int) -> np.ndarray:
-    shape = image.shape
-    img_width = shape[1]
-    img_height = shape[0]
-    if w is None:
-        w = img_width
-    if h is None:
-        h = img_height
-
-    x_pad_left = max(0, -x)
-    y_pad_left = max(0, -y)
-
-    x1 = max(0, x)
-    y1 = max(0, y)
-    x2 = min(x1 + w - x_pad_left, img_width - x_pad_left)
-    y2 = min(y1 + h - y_pad_left, img_height - y_pad_left)
-    image = image[y1:y2, x1:x2]
-
-    x_pad = (x_pad_left, w - (x2 - x1) - x_pad_left)
-    y_pad = (y_pad_left, h - (y2 - y1) - y_pad_left)
-    if x_pad != (0, 0) or y_pad != (0, 0):
-        image = np.pad(image, (y_pad, x_pad, (0, 0)))
-
-    return image
+    return CropRegion(image, x, y, w, h).to_array()
 
 
 def np_save_image(image: np.ndarray, out: str):
@@ -0,0 +1,272 @@
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .np_utils import np_crop
+
+MAX_SCORE = 400
+"""Highest total penalty a character can have and still be read, same as Alt1"""
+SCORE_WINDOW = 32
+"""Columns of a line scored at a time, so reading stops scoring where the text ends"""
+BACKGROUND_MATCH = 64
+"""Background pixels of a glyph this close to the text color (max channel difference)
+are penalized by how close they are, so solid blocks of color do not read as text"""
+
+DEFAULT_COLORS = [
+    (255, 255, 255),
+    (255, 255, 0),
+    (255, 140, 0),
+    (0, 255, 0),
+    (255, 0, 0),
+    (0, 255, 255),
+]
+"""RGB colors tried when reading a string of unknown color"""
+
+
+class Glyph(NamedTuple):
+    char: str
+    width: int
+    bonus: float
+    secondary: bool
+
+
+class ReadResult(NamedTuple):
+    text: str
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+def decode_rgb(color: int) -> Tuple[int, int, int]:
+    """Decode Alt1 0xAARRGGBB color to RGB"""
+    return (color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF
+
+
+class OCRFont:
+    """A font in Alt1 font definition format, precomputed for matching.
+
+    Every glyph pixel is stored as (x, y, intensity[, shadow intensity]). A pixel
+    matches if the observed color can be a blend of the text color (and black
+    shadow) over some background, like Alt1's canblend. The other pixels of the
+    glyph box are background, and are penalized when they look like the text
+    color. Matching every glyph at a window of columns is a single gather of the
+    observed pixels under each glyph pixel."""
+
+    glyphs: List[Glyph]
+
+    def __init__(self, definition: Dict):
+        self.width = definition["width"]
+        self.height = definition["height"]
+        self.basey = definition["basey"]
+        self.spacewidth = definition["spacewidth"]
+        self.shadow = definition.get("shadow", False)
+        self.maxspaces = definition.get("maxspaces", 1)
+
+        stride = 4 if self.shadow else 3
+        glyphs = []
+        pixel_text = []
+        pixel_shadow = []
+        pixel_x = []
+        pixel_y = []
+        starts = []
+        background_x = []
+        background_y = []
+        background_starts = []
+
+        for char in definition["chars"]:
+            pixels = char["pixels"]
+            if not pixels:
+                continue
+
+            starts.append(len(pixel_text))
+            glyphs.append(
+                Glyph(
+                    char=char["chr"],
+                    width=char["width"],
+                    bonus=char.get("bonus", 0),
+                    secondary=char.get("secondary", False),
+                )
+            )
+
+            covered = set()
+            for i in range(0, len(pixels), stride):
+                pixel_text.append(pixels[i + 2])
+                pixel_shadow.append(pixels[i + 3] if self.shadow else 0)
+                pixel_x.append(pixels[i])
+                pixel_y.append(pixels[i + 1])
+                covered.add((pixels[i], pixels[i + 1]))
+
+            background_starts.append(len(background_x))
+            for by in range(self.height):
+                for bx in range(char["width"]):
+                    if (bx, by) not in covered:
+                        background_x.append(bx)
+                        background_y.append(by)
+
+        self.glyphs = glyphs
+        text = np.array(pixel_text, dtype=np.float32) / 255
+        shadow = np.array(pixel_shadow, dtype=np.float32) / 255
+        self._pixel_text = text[:, None, None]
+        # The divisor is capped like canblend
+        self._pixel_divisor = np.maximum(1 - text - shadow, 1 / 51)[:, None, None]
+        self._pixel_x = np.array(pixel_x, dtype=np.intp)[:, None]
+        self._pixel_y = np.array(pixel_y, dtype=np.intp)[:, None]
+        self._starts = np.array(starts, dtype=np.intp)
+        self._background_x = np.array(background_x, dtype=np.intp)[:, None]
+        self._background_y = np.array(background_y, dtype=np.intp)[:, None]
+        self._background_bounds = np.array(
+            [*background_starts, len(background_x)], dtype=np.intp
+        )
+        self._bonus = np.array([glyph.bonus for glyph in glyphs], dtype=np.float32)
+        self._secondary = np.array([glyph.secondary for glyph in glyphs], dtype=bool)
+
+    @staticmethod
+    def _background_map(band: np.ndarray, color: Tuple[int, int, int]) -> np.ndarray:
+        """Return the penalty of every band pixel for being background"""
+        bgr = np.array(color[::-1], dtype=np.float32)
+        distance = np.abs(band - bgr).max(axis=-1)
+        return np.maximum(BACKGROUND_MATCH - distance, 0)
+
+    def score(self, band: np.ndarray, color: Tuple[int, int, int]) -> np.ndarray:
+        """Score every glyph at every column of a band of font height.
+        Return an array of shape (glyph, column), lower is better"""
+        columns = band.shape[1] - self.width
+        if columns <= 0:
+            return np.full((len(self.glyphs), 0), np.inf, dtype=np.float32)
+
+        offsets = np.arange(columns)[None, :]
+        bgr = np.array(color[::-1], dtype=np.float32)
+        observed = band[self._pixel_y, self._pixel_x + offsets]
+
+        # Solve observed = text * color + shadow * black + (1 - text - shadow) * background
+        # and penalize backgrounds out of range
+        background = (observed - self._pixel_text * bgr) / self._pixel_divisor
+        penalty = np.maximum(-background, background - 255).max(axis=-1)
+        np.maximum(penalty, 0, out=penalty)
+        out = np.add.reduceat(penalty, self._starts, axis=0)
+
+        if len(self._background_x):
+            background = self._background_map(band, color)[
+                self._background_y, self._background_x + offsets
+            ]
+            # Sum per glyph through a cumulative sum, as a glyph may have no background
+            totals = np.zeros((len(background) + 1, columns), dtype=np.float32)
+            np.cumsum(background, axis=0, out=totals[1:])
+            bounds = self._background_bounds
+            out += totals[bounds[1:]] - totals[bounds[:-1]]
+
+        return out
+
+    def _rank(
+        self, band: np.ndarray, color: Tuple[int, int, int], start: int, stop: int
+    ) -> np.ndarray:
+        """Score columns start to stop of a band, with bonus applied and
+        unreadable matches set to infinity"""
+        scores = self.score(band[:, start : stop + self.width], color)
+        return np.where(
+            scores <= MAX_SCORE, scores - self._bonus[:, None], np.float32(np.inf)
+        )
+
+    def read_line(
+        self,
+        image: np.ndarray,
+        x: int,
+        y: int,
+        colors: Sequence[Tuple[int, int, int]] = DEFAULT_COLORS,
+        allow_gap=True,
+    ) -> Optional[ReadResult]:
+        """Read text with baseline at y. The first character is searched within
+        a character width from x"""
+        top = y - self.basey
+        band = np_crop(
+            image, x, top, max(0, image.shape[1] - x) + self.width, self.height
+        )
+        band = band[:, :, :3].astype(np.float32)
+        columns = band.shape[1] - self.width
+        if columns <= 0:
+            return None
+
+        # Start at the best primary character within a character width, in any
+        # color, and keep reading in that color
+        first_stop = min(self.width, columns)
+        firsts = [self._rank(band, color, 0, first_stop) for color in colors]
+        first = np.stack(
+            [ranked[~self._secondary].min(axis=0, initial=np.inf) for ranked in firsts]
+        )
+        if not np.isfinite(first).any():
+            return None
+
+        color, start = np.unravel_index(np.argmin(first), first.shape)
+        start = int(start)
+        ranked = _LineScores(self, band, colors[color], firsts[color])
+
+        text = []
+        pos = start
+        end = start
+        while pos < columns:
+            column = ranked.get(pos, pos + 1)[:, 0]
+            glyph = int(np.argmin(column))
+            if np.isfinite(column[glyph]):
+                text.append(self.glyphs[glyph].char)
+                pos += self.glyphs[glyph].width
+                end = pos
+                continue
+
+            if not allow_gap:
+                break
+
+            # Look for the next character within the allowed number of spaces
+            window = ranked.get(pos, pos + self.spacewidth * self.maxspaces + 1)
+            found = np.isfinite(window).any(axis=0).nonzero()[0]
+            if len(found) == 0:
+                break
+
+            # Glyphs with blank left columns also match a little early,
+            # take the best match within a character width of the first
+            gap = int(found[0])
+            gap += int(
+                np.argmin(ranked.get(pos + gap, pos + gap + self.width).min(axis=0))
+            )
+            if gap * 2 >= self.spacewidth:
+                text.append(" " * max(1, round(gap / self.spacewidth)))
+            pos += gap
+
+        return ReadResult(
+            text="".join(text),
+            x=x + start,
+            y=top,
+            width=end - start,
+            height=self.height,
+        )
+
+
+class _LineScores:
+    """Ranked glyph scores of a line in one color, scored a window at a time as
+    reading advances"""
+
+    def __init__(
+        self,
+        font: OCRFont,
+        band: np.ndarray,
+        color: Tuple[int, int, int],
+        first: np.ndarray,
+    ):
+        self.font = font
+        self.band = band
+        self.color = color
+        self.columns = band.shape[1] - font.width
+        self.ranked = np.empty((len(font.glyphs), self.columns), dtype=np.float32)
+        self.ranked[:, : first.shape[1]] = first
+        self.scored = first.shape[1]
+
+    def get(self, start: int, stop: int) -> np.ndarray:
+        stop = min(stop, self.columns)
+        while self.scored < stop:
+            end = min(max(stop, self.scored + SCORE_WINDOW), self.columns)
+            self.ranked[:, self.scored : end] = self.font._rank(
+                self.band, self.color, self.scored, end
+            )
+            self.scored = end
+
+        return self.ranked[:, start:stop]
@@ -0,0 +1,123 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+"""Upper bounds of latency histogram buckets, in milliseconds"""
+
+
+class Histogram:
+    """Latency histogram with fixed buckets. Not thread safe, use through Metrics"""
+
+    def __init__(self):
+        self.buckets: List[int] = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percent: float) -> float:
+        """Approximate percentile, as the upper bound of the bucket it falls in"""
+        if self.count == 0:
+            return 0.0
+
+        target = self.count * percent / 100
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "max": self.max,
+            "buckets": dict(zip([*map(str, BUCKETS), "inf"], self.buckets)),
+        }
+
+
+class Metrics:
+    """Process wide registry of latency histograms, counters and cache hit rates.
+
+    Metric names are dotted, with the pipeline stage first (capture, crop, encode,
+    rpc) so related metrics sort together."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._histograms: Dict[str, Histogram] = {}
+            self._counters: Dict[str, int] = {}
+            self._caches: Dict[str, List[int]] = {}
+            self._started = time.time()
+
+    def observe(self, name: str, value: float):
+        """Record a latency in milliseconds"""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+
+            histogram.observe(value)
+
+    @contextmanager
+    def time(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000)
+
+    def increment(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def cache(self, name: str, hit: bool):
+        with self._lock:
+            stats = self._caches.get(name)
+            if stats is None:
+                stats = self._caches[name] = [0, 0]
+
+            stats[0 if hit else 1] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "started": self._started,
+                "time": time.time(),
+                "latency": {
+                    name: histogram.snapshot()
+                    for name, histogram in sorted(self._histograms.items())
+                },
+                "counters": dict(sorted(self._counters.items())),
+                "caches": {
+                    name: {
+                        "hits": hits,
+                        "misses": misses,
+                        "rate": hits / (hits + misses),
+                    }
+                    for name, (hits, misses) in sorted(self._caches.items())
+                },
+            }
+
+    def dump(self, path: str):
+        with open(path, "w") as fp:
+            json.dump(self.snapshot(), fp, indent=2)
+
+
+metrics = Metrics()